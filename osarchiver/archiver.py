@@ -7,8 +7,12 @@ The Archiver class file
 """
 
 import logging
+import queue
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from osarchiver.errors import OSArchiverArchivingFailed
+from osarchiver.scheduler import TableScheduler
 
 
 class Archiver():
@@ -16,7 +20,9 @@ class Archiver():
     Archiver class
     """
 
-    def __init__(self, name=None, src=None, dst=None, conf=None):
+    def __init__(self, name=None, src=None, dst=None, conf=None, workers=1,
+                 checkpoint=None, resume=False, pipeline=False,
+                 pipeline_depth=2):
         """
         instantiator, take one source and a list of destinations
         """
@@ -27,17 +33,61 @@ class Archiver():
         self.dst = dst or []
         # Config parser instance
         self.conf = conf
+        # Number of tables archived concurrently
+        self.workers = int(workers)
+        # Set to stop the workers
+        self.stop_event = threading.Event()
+        # Checkpoint instance saving the progress of the run
+        self.checkpoint = checkpoint
+        # Restart from the checkpoint of an interrupted run
+        self.resume = resume
+        # Overlap the read, write and delete of the sets of data of a table
+        self.pipeline = pipeline
+        # Number of sets of data waiting between two stages of the pipeline
+        self.pipeline_depth = max(int(pipeline_depth), 1)
+        # Source instance with its own connection used to read in pipeline
+        self._pipeline_src = None
 
     def __repr__(self):
         return "Archiver {name}: {src} -> {dst}".\
             format(name=self.name, src=self.src, dst=self.dst)
 
-    def read(self):
+    def clone(self):
+        """
+        Return a copy of the archiver with its own Source and Destination
+        instances, to be used by a worker
+        """
+        src = self.src.clone()
+        clone = Archiver(name=self.name,
+                         src=src,
+                         dst=[d.clone(source=src) for d in self.dst],
+                         conf=self.conf,
+                         checkpoint=self.checkpoint,
+                         resume=self.resume,
+                         pipeline=self.pipeline,
+                         pipeline_depth=self.pipeline_depth)
+        clone.stop_event = self.stop_event
+        return clone
+
+    def close_clone(self, clone):
+        """
+        Close the Source and Destination instances of a clone which are not
+        shared with the current archiver
+        """
+        if clone.src is not self.src:
+            clone.src.clean_exit()
+        if clone._pipeline_src is not None:
+            clone._pipeline_src.clean_exit()
+        for dst in clone.dst:
+            if dst not in self.dst:
+                dst.clean_exit()
+
+    def read(self, **kwargs):
         """
         read method which loop over each set of data from Source instance
         yield database, table, items
         """
-        for data in self.src.read():
+        for data in self.src.read(**kwargs):
             for items in data['data']:
                 yield (data['database'], data['table'], items)
 
@@ -55,6 +105,10 @@ class Archiver():
             for dst in self.dst:
                 try:
                     dst.write(database=database, table=table, data=data)
+                    # the rows are deleted then recorded in the checkpoint,
+                    # they must not stay in a buffer
+                    if self.checkpoint is not None:
+                        dst.flush(database=database, table=table, data=data)
                 except Exception as my_exception:
                     logging.error(
                         "An error occured while archiving data: %s",
@@ -62,22 +116,28 @@ class Archiver():
                     logging.error("Full traceback is: %s",
                                   traceback.format_exc())
                     raise OSArchiverArchivingFailed
+            # the durable size of the files is saved before the deletion
+            if self.checkpoint is not None:
+                self.checkpoint.save_files(destinations=self.dst)
 
     def delete(self, database=None, table=None, data=None):
         """
         delete method take a set of data, database, table as arguments and
         delete the data from source if the delete_data prameters is true
+        return True if the data have been deleted
         """
         if not self.src.delete_data:
             logging.debug("Ignoring data deletion because delete_data is "
                           "set to %s", self.src.delete_data)
-        else:
-            try:
-                self.src.delete(database=database, table=table, data=data)
-            except Exception as my_exception:
-                logging.error("An error occured while deleting data: %s",
-                              my_exception)
-                logging.error("Full traceback is: %s", traceback.format_exc())
+            return False
+        try:
+            self.src.delete(database=database, table=table, data=data)
+        except Exception as my_exception:
+            logging.error("An error occured while deleting data: %s",
+                          my_exception)
+            logging.error("Full traceback is: %s", traceback.format_exc())
+            return False
+        return True
 
     def run(self):
         """
@@ -93,18 +153,338 @@ class Archiver():
             logging.info("Data won't be deleted because 'delete_data' set to"
                          " %s", self.src.delete_data)
 
-        for (database, table, items) in self.read():
-            try:
-                self.write(database=database, table=table, data=items)
-            except OSArchiverArchivingFailed:
-                logging.info("Ignoring deletion step because an error occured "
-                             "while archiving data")
-            else:
-                self.delete(database=database, table=table, data=items)
+        self.init_checkpoint()
+
+        # The content of the rows is read only if a destination needs it
+        if self.src.archive_data and self.dst and \
+                not [d for d in self.dst if d.needs_rows()]:
+            logging.info("No destination of archiver %s needs the content of "
+                         "the rows, selecting only their keys", self.name)
+            self.src.select_keys_only = True
+
+        if self.src.database_concurrency > 1:
+            self.run_databases_concurrently(
+                concurrency=self.src.database_concurrency)
+        else:
+            for database in self.src.databases_to_archive():
+                if self.stop_event.is_set():
+                    break
+                self.run_database(database=database)
 
         self.clean_exit()
+        # The run is complete, the next one starts from scratch
+        if self.checkpoint is not None and not self.stop_event.is_set():
+            self.checkpoint.clear()
         return 0
 
+    def init_checkpoint(self):
+        """
+        Load the checkpoint of the previous run when resuming, the files left
+        by the destinations are handed over to be compressed with the new
+        ones. Otherwise the checkpoint is reset.
+        """
+        if self.checkpoint is None:
+            if self.resume:
+                logging.warning("Archiver %s can't be resumed, no "
+                                "checkpoint_file configured", self.name)
+            return
+
+        if not self.resume:
+            self.checkpoint.clear()
+            return
+
+        self.checkpoint.load()
+        files = self.checkpoint.files()
+        if files:
+            for dst in self.dst:
+                dst.adopt_files(files=files)
+            self.checkpoint.save_files(destinations=self.dst)
+
+    def run_databases_concurrently(self, concurrency=1):
+        """
+        Archive each database of the source with its own worker, which is a
+        clone of the archiver with its own Source and Destination connections
+        """
+        def run_database_worker(database):
+            worker = self.clone()
+            worker.workers = self.workers
+            try:
+                worker.run_database(database=database)
+            finally:
+                self.close_clone(worker)
+
+        databases = self.src.databases_to_archive()
+        logging.info("Archiving %s databases with a concurrency of %s",
+                     len(databases), concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(run_database_worker, database)
+                for database in databases
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                self.stop_event.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def run_database(self, database=None):
+        """
+        Archive all the tables of one database, using the table scheduler if
+        several workers are configured
+        """
+        if self.workers > 1:
+            scheduler = TableScheduler(archiver=self, workers=self.workers)
+            scheduler.run(database=database)
+            return
+
+        for table in self.src.tables_to_archive(database=database):
+            if self.stop_event.is_set():
+                break
+            self.run_table(database=database, table=table)
+
+    def table_key_ranges(self, database=None, table=None):
+        """
+        Return the primary key ranges of a table which can be archived
+        concurrently, the ranges of an interrupted run are reused when
+        resuming so that the progress of each range remains valid
+        """
+        if self.checkpoint is not None:
+            ranges = self.checkpoint.get(database=database,
+                                         table=table).get('ranges')
+            if ranges is not None:
+                return [tuple(r) for r in ranges]
+        ranges = self.src.table_key_ranges(database=database, table=table)
+        if self.checkpoint is not None and len(ranges) > 1:
+            self.checkpoint.update(database=database,
+                                   table=table,
+                                   ranges=ranges)
+        return ranges
+
+    def run_table(self, database=None, table=None, key_range=None,
+                  part=None):
+        """
+        Archive and delete the data of one table, stop between two sets of
+        data if the stop event is set
+        If key_range is given only the primary keys in this range are
+        archived, part being the number of the range in the table
+        """
+        (last_selected_id, max_selected_id) = key_range or (None, None)
+        if self.checkpoint is not None:
+            progress = self.checkpoint.get(database=database,
+                                           table=table,
+                                           part=part)
+            if progress.get('done'):
+                logging.info("%s.%s is already archived according to the "
+                             "checkpoint, skipping it", database, table)
+                return
+            # Rows archived but not deleted are still to delete
+            last_checkpoint_id = progress.get(
+                'last_deleted' if self.src.delete_data else 'last_archived')
+            if last_checkpoint_id is not None:
+                last_selected_id = last_checkpoint_id
+                logging.info("Resuming %s.%s after key %s", database, table,
+                             last_selected_id)
+
+        if self.pipeline:
+            if not self.run_table_pipeline(database=database,
+                                           table=table,
+                                           last_selected_id=last_selected_id,
+                                           max_selected_id=max_selected_id,
+                                           part=part):
+                return
+        else:
+            for (database, table, items) in self.read(
+                    database=database,
+                    table=table,
+                    last_selected_id=last_selected_id,
+                    max_selected_id=max_selected_id):
+                if self.stop_event.is_set():
+                    logging.info("Stopping archiving of %s.%s", database,
+                                 table)
+                    return
+                self.process(database=database, table=table, data=items,
+                             part=part)
+
+        if self.checkpoint is not None and not self.stop_event.is_set():
+            self.checkpoint.update(database=database,
+                                   table=table,
+                                   part=part,
+                                   done=True)
+
+    def pipeline_source(self):
+        """
+        Return the Source instance used to read in pipeline, a clone of the
+        source with its own connection so that the reads do not wait for the
+        deletes
+        """
+        if self._pipeline_src is None:
+            self._pipeline_src = self.src.clone()
+        return self._pipeline_src
+
+    def run_table_pipeline(self,
+                           database=None,
+                           table=None,
+                           last_selected_id=None,
+                           max_selected_id=None,
+                           part=None):
+        """
+        Archive and delete the data of one table with three overlapped
+        stages: a reader thread selects the sets of data, a writer thread
+        archives them in the destinations and the current thread deletes
+        them. The stages are connected by queues of pipeline_depth sets of
+        data, a stage waits when the next one is late. A set of data is
+        deleted only if it has been archived.
+        Return True if the whole table has been read
+        """
+        write_queue = queue.Queue(maxsize=self.pipeline_depth)
+        delete_queue = queue.Queue(maxsize=self.pipeline_depth)
+        # set when a stage fails or once the deleter is done, the other
+        # stages stop waiting on the queues
+        abort = threading.Event()
+        errors = []
+        complete = []
+        reader_src = self.pipeline_source()
+
+        def put(stage_queue, item):
+            while not abort.is_set():
+                try:
+                    stage_queue.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(stage_queue):
+            while not abort.is_set():
+                try:
+                    return stage_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def reader():
+            try:
+                for data in reader_src.read(database=database,
+                                            table=table,
+                                            last_selected_id=last_selected_id,
+                                            max_selected_id=max_selected_id):
+                    for items in data['data']:
+                        if self.stop_event.is_set():
+                            logging.info("Stopping archiving of %s.%s",
+                                         database, table)
+                            return
+                        if not put(write_queue, items):
+                            return
+                complete.append(True)
+            except BaseException as reader_exception:
+                errors.append(reader_exception)
+                abort.set()
+            finally:
+                put(write_queue, None)
+
+        def writer():
+            try:
+                while True:
+                    items = get(write_queue)
+                    if items is None:
+                        return
+                    archived = True
+                    try:
+                        self.write(database=database, table=table, data=items)
+                    except OSArchiverArchivingFailed:
+                        logging.info("Ignoring deletion step because an "
+                                     "error occured while archiving data")
+                        archived = False
+                    if not put(delete_queue, (items, archived)):
+                        return
+            except BaseException as writer_exception:
+                errors.append(writer_exception)
+                abort.set()
+            finally:
+                put(delete_queue, None)
+
+        stages = [
+            threading.Thread(target=reader,
+                             name='{}-reader'.format(self.name)),
+            threading.Thread(target=writer,
+                             name='{}-writer'.format(self.name))
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            while True:
+                item = get(delete_queue)
+                if item is None:
+                    break
+                (items, archived) = item
+                deleted = False
+                if archived:
+                    deleted = self.delete(database=database,
+                                          table=table,
+                                          data=items)
+                self.update_checkpoint(database=database,
+                                       table=table,
+                                       part=part,
+                                       data=items,
+                                       archived=archived,
+                                       deleted=deleted)
+        finally:
+            abort.set()
+            for stage in stages:
+                stage.join()
+
+        if errors:
+            raise errors[0]
+        return bool(complete)
+
+    def process(self, database=None, table=None, data=None, part=None):
+        """
+        Archive a set of data then delete it if no exception were caught
+        """
+        archived = False
+        deleted = False
+        try:
+            self.write(database=database, table=table, data=data)
+            archived = True
+        except OSArchiverArchivingFailed:
+            logging.info("Ignoring deletion step because an error occured "
+                         "while archiving data")
+        else:
+            deleted = self.delete(database=database, table=table, data=data)
+
+        self.update_checkpoint(database=database,
+                               table=table,
+                               part=part,
+                               data=data,
+                               archived=archived,
+                               deleted=deleted)
+
+    def update_checkpoint(self,
+                          database=None,
+                          table=None,
+                          part=None,
+                          data=None,
+                          archived=False,
+                          deleted=False):
+        """
+        Save in the checkpoint the key of the last row of a set of data
+        archived and/or deleted
+        """
+        if self.checkpoint is None or not data or not (archived or deleted):
+            return
+        key = self.src.last_selected_key(database=database,
+                                         table=table,
+                                         data=data)
+        self.checkpoint.update(
+            database=database,
+            table=table,
+            part=part,
+            last_archived=key if archived else None,
+            last_deleted=key if deleted else None)
+
     def clean_exit(self):
         """
         method called when archiving is finished. It calls clean_exit method of
@@ -112,5 +492,10 @@ class Archiver():
         """
         logging.info("Please wait for clean exit...")
         self.src.clean_exit()
+        if self._pipeline_src is not None:
+            self._pipeline_src.clean_exit()
         for dst in self.dst:
             dst.clean_exit()
+        # the files are closed, their size is final
+        if self.checkpoint is not None:
+            self.checkpoint.save_files(destinations=self.dst)
@@ -0,0 +1,151 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+The Checkpoint class file
+
+A checkpoint keeps in a local state file the progress of an archiver: for
+each table, or each primary key range of a split table, the key of the last
+row archived and deleted, and the files being written by the destinations
+with their size durable on the disk.
+It allows to resume an interrupted run.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class Checkpoint():
+    """
+    Progress of an archiver persisted in a JSON state file
+    """
+
+    def __init__(self, path=None, name=None):
+        """
+        instantiator, take the path of the state file and the name of the
+        archiver
+        """
+        self.path = path
+        self.name = name
+        self.state = {'archiver': name, 'tables': {}, 'files': {}}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return "Checkpoint of {name}: {path}".format(name=self.name,
+                                                     path=self.path)
+
+    @staticmethod
+    def table_key(database=None, table=None, part=None):
+        """
+        Return the key of a table, or of a key range of the table, in the
+        state
+        """
+        if part is None:
+            return '{db}.{table}'.format(db=database, table=table)
+        return '{db}.{table}#{part}'.format(db=database,
+                                            table=table,
+                                            part=part)
+
+    def load(self):
+        """
+        Load the state file of a previous run
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                logging.info("No checkpoint found in %s, nothing to resume",
+                             self.path)
+                return self.state
+            with open(self.path, 'r', encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            if state.get('archiver') != self.name:
+                logging.warning(
+                    "Checkpoint %s belongs to archiver %s, not resuming it",
+                    self.path, state.get('archiver'))
+                return self.state
+            self.state = state
+            logging.info("Resuming archiver %s from checkpoint %s: %s tables "
+                         "in progress or done", self.name, self.path,
+                         len(self.state['tables']))
+            return self.state
+
+    def save(self):
+        """
+        Write the state file, using a temporary file renamed once written so
+        that an interruption while writing does not corrupt the checkpoint
+        """
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as state_file:
+                json.dump(self.state, state_file, default=str)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """
+        Remove the state file, called when the run is finished
+        """
+        with self._lock:
+            self.state = {'archiver': self.name, 'tables': {}, 'files': {}}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def get(self, database=None, table=None, part=None):
+        """
+        Return the progress of a table, an empty dict if none
+        """
+        with self._lock:
+            return dict(self.state['tables'].get(
+                self.table_key(database=database, table=table, part=part),
+                {}))
+
+    def files(self):
+        """
+        Return a dict of the files written by the destinations of the
+        checkpointed run and of their durable size
+        """
+        with self._lock:
+            return dict(self.state['files'])
+
+    def save_files(self, destinations=None):
+        """
+        Save the files written by destinations and their durable size, then
+        tell the destinations that they are saved. The sizes are read and
+        saved in one step, so that the files saved are never older than the
+        ones saved before. The state file is written only if they changed
+        """
+        with self._lock:
+            files = {}
+            for destination in destinations or []:
+                files.update(destination.file_sizes())
+            if [f for f in files if f not in self.state['files'] or
+                    self.state['files'][f] != files[f]]:
+                self.state['files'].update(files)
+                self.save()
+            for destination in destinations or []:
+                destination.checkpointed(files=files)
+
+    def update(self,
+               database=None,
+               table=None,
+               part=None,
+               last_archived=None,
+               last_deleted=None,
+               done=None,
+               ranges=None):
+        """
+        Update the progress of a table and write the state file
+        """
+        with self._lock:
+            progress = self.state['tables'].setdefault(
+                self.table_key(database=database, table=table, part=part),
+                {})
+            if last_archived is not None:
+                progress['last_archived'] = last_archived
+            if last_deleted is not None:
+                progress['last_deleted'] = last_deleted
+            if done is not None:
+                progress['done'] = done
+            if ranges is not None:
+                progress['ranges'] = ranges
+            self.save()
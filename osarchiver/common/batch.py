@@ -0,0 +1,124 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Batch class file which provide the representation of a set of data read from
+a Source and given to the Destinations
+
+A Batch holds the columns names of the table once, and the rows as plain
+tuples, as returned by the default pymysql cursor. The BatchCursor and
+SSBatchCursor pymysql cursors return Batch instances when fetching data.
+"""
+
+import pymysql
+
+
+class Batch():
+    """
+    A set of rows of a table
+    """
+
+    __slots__ = ('columns', 'rows', '_index')
+
+    def __init__(self, columns=(), rows=()):
+        """
+        instantiator, take the tuple of columns names and the sequence of rows
+        """
+        self.columns = tuple(columns)
+        self.rows = rows
+        self._index = None
+
+    def __repr__(self):
+        return "Batch of {count} rows ({columns})".format(
+            count=len(self.rows), columns=', '.join(self.columns))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, key):
+        """
+        Return a row or a Batch when slicing
+        """
+        if isinstance(key, slice):
+            return Batch(columns=self.columns, rows=self.rows[key])
+        return self.rows[key]
+
+    def index(self, column=None):
+        """
+        Return the position of a column in the rows
+        """
+        if self._index is None:
+            self._index = {c: i for (i, c) in enumerate(self.columns)}
+        return self._index[column]
+
+    def values(self, column=None):
+        """
+        Return the list of values of a column
+        """
+        idx = self.index(column)
+        return [row[idx] for row in self.rows]
+
+    def row_key(self, row=None, columns=None):
+        """
+        Return the value of the key of a row, which is a tuple if the key is
+        made of several columns
+        """
+        if len(columns) == 1:
+            return row[self.index(columns[0])]
+        return tuple([row[self.index(c)] for c in columns])
+
+    def keys(self, columns=None):
+        """
+        Return the list of the keys of all the rows
+        """
+        if len(columns) == 1:
+            return self.values(columns[0])
+        indexes = [self.index(c) for c in columns]
+        return [tuple([row[i] for i in indexes]) for row in self.rows]
+
+    def as_dict(self, row=None):
+        """
+        Return a row as a dict of column: value
+        """
+        return dict(zip(self.columns, row))
+
+    def as_dicts(self):
+        """
+        Return the rows as a list of dict
+        """
+        return [self.as_dict(row) for row in self.rows]
+
+
+class BatchCursorMixin():
+    """
+    Mixin which makes a pymysql cursor return Batch instances from fetchall
+    and fetchmany
+    """
+
+    def _batch(self, rows):
+        columns = [d[0] for d in self.description or ()]
+        return Batch(columns=columns, rows=rows)
+
+    def fetchall(self):
+        return self._batch(super().fetchall())
+
+    def fetchmany(self, size=None):
+        return self._batch(super().fetchmany(size))
+
+
+class BatchCursor(BatchCursorMixin, pymysql.cursors.Cursor):
+    """
+    A cursor which returns results as Batch
+    """
+
+
+class SSBatchCursor(BatchCursorMixin, pymysql.cursors.SSCursor):
+    """
+    An unbuffered cursor which returns results as Batch
+    """
@@ -0,0 +1,104 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+MetadataCache class file which provide a persistent storage of metadata in a
+JSON file, to reuse them from one run to another.
+
+One instance is shared per file so that the Source and the Destinations
+using the same file do not overwrite the entries of each other.
+"""
+
+import json
+import logging
+import os
+import threading
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_metadata_cache(path=None):
+    """
+    Return the MetadataCache instance of a file, None if no path is given
+    """
+    if not path:
+        return None
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = MetadataCache(path=path)
+        return _CACHES[path]
+
+
+class MetadataCache():
+    """
+    Key/value store persisted in a JSON file
+    """
+
+    def __init__(self, path=None):
+        """
+        instantiator, the file is read on first access
+        """
+        self.path = path
+        self._data = None
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return "MetadataCache {path}".format(path=self.path)
+
+    def load(self):
+        """
+        Read the cache file, a missing or corrupted file is an empty cache
+        """
+        with self._lock:
+            if self._data is not None:
+                return self._data
+            self._data = {}
+            if not os.path.exists(self.path):
+                return self._data
+            try:
+                with open(self.path, 'r', encoding='utf-8') as cache_file:
+                    self._data = json.load(cache_file)
+                logging.debug("Metadata cache %s loaded", self.path)
+            except (OSError, ValueError) as cache_exception:
+                logging.warning("Ignoring metadata cache %s: %s", self.path,
+                                cache_exception)
+            return self._data
+
+    def get(self, key=None):
+        """
+        Return the value of a key, None if not cached
+        """
+        with self._lock:
+            return self.load().get(key)
+
+    def set(self, key=None, value=None):
+        """
+        Set the value of a key and write the cache file
+        """
+        with self._lock:
+            self.load()[key] = value
+            self.save()
+
+    def delete(self, key=None):
+        """
+        Remove a key from the cache and write the cache file
+        """
+        with self._lock:
+            if self.load().pop(key, None) is not None:
+                self.save()
+
+    def save(self):
+        """
+        Write the cache file, using a temporary file renamed once written so
+        that an interrupted write does not corrupt the cache
+        """
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+                    json.dump(self.load(), cache_file, default=str)
+                os.replace(tmp_path, self.path)
+            except OSError as cache_exception:
+                logging.warning("Unable to write metadata cache %s: %s",
+                                self.path, cache_exception)
@@ -10,6 +10,8 @@ several times. It also keeps a reference on pymysq.cursor per table to
 avoid creating too much cursor
 """
 
+import copy
+import hashlib
 import logging
 import re
 import warnings
@@ -20,6 +22,55 @@ import timeit
 import datetime  # noqa
 import pymysql
 from sqlalchemy import create_engine
+from osarchiver.common.schema import Schema
+from osarchiver.common.cache import get_metadata_cache
+
+
+class AdaptiveLimit():
+    """
+    Controller of a number of rows handled per statement (LIMIT of a select,
+    size of a delete or of a bulk insert). From the duration of the last
+    statement, it grows or shrinks the number of rows so that the duration of
+    the statements stays close to a target duration.
+    """
+
+    def __init__(self, value=None, target=None, minimum=1, maximum=None):
+        """
+        instantiator, take the initial number of rows, the target duration
+        of a statement in seconds and the bounds of the number of rows
+        """
+        self.value = int(value)
+        self.target = float(target)
+        self.minimum = int(minimum)
+        self.maximum = int(maximum) if maximum is not None else None
+
+    def __repr__(self):
+        return "AdaptiveLimit {value} rows [target:{target}s]".format(
+            value=self.value, target=self.target)
+
+    def update(self, duration=None, rows=None):
+        """
+        Compute the next number of rows from the duration of a statement that
+        handled the given number of rows. A step can not more than double or
+        halve the value and a deviation of less than 10% is ignored.
+        """
+        if not rows or duration is None or duration <= 0:
+            return self.value
+
+        # number of rows that would be handled during the target duration
+        ideal = rows * self.target / duration
+        ideal = min(max(ideal, self.value / 2), self.value * 2)
+        if abs(ideal - self.value) < self.value * 0.1:
+            return self.value
+
+        value = max(int(ideal), self.minimum)
+        if self.maximum is not None:
+            value = min(value, self.maximum)
+        if value != self.value:
+            logging.debug("Adapting limit from %s to %s rows (%s rows in %s "
+                          "sec)", self.value, value, rows, duration)
+        self.value = value
+        return self.value
 
 
 class DbBase():
@@ -42,6 +93,11 @@ class DbBase():
                  retry_time_limit=2,
                  delete_loop_delay=2,
                  foreign_key_check=True,
+                 target_statement_time=0,
+                 adaptive_limit_min=10,
+                 adaptive_limit_max=100000,
+                 metadata_cache=None,
+                 metadata_cache_checksum=False,
                  **kwargs):
         """
         instantiator of database base class
@@ -57,6 +113,14 @@ class DbBase():
         self.bulk_insert = int(bulk_insert)
         self.dry_run = dry_run
         self.metadata = {}
+        # schema snapshots per database, shared with the clones
+        self.schemas = {}
+        # optional file in which schema snapshots are kept between runs
+        self.metadata_cache = get_metadata_cache(path=metadata_cache)
+        self.metadata_cache_checksum = metadata_cache_checksum
+        # schema fingerprints per database computed during the run, shared
+        # with the clones
+        self.fingerprints = {}
         self._sqlalchemy_engine = None
         # number of retries when an error occure
         self.max_retries = max_retries
@@ -64,6 +128,17 @@ class DbBase():
         self.retry_time_limit = retry_time_limit
         self.delete_loop_delay = delete_loop_delay
         self.foreign_key_check = foreign_key_check
+        # target duration in seconds of a statement, the select, delete and
+        # bulk insert limits are adapted per table to stay near this
+        # duration, 0 disables the adaptation
+        self.target_statement_time = float(target_statement_time)
+        self.adaptive_limit_min = int(adaptive_limit_min)
+        self.adaptive_limit_max = int(adaptive_limit_max)
+        # adaptive limits per database.table, kept for the whole run
+        self.adaptive_limits = {}
+        # duration of the last execute and commit
+        self.last_execute_duration = 0
+        self.last_commit_duration = 0
 
         # hide some warnings we do not care
         warnings.simplefilter("ignore")
@@ -82,16 +157,24 @@ class DbBase():
 
         return self._sqlalchemy_engine
 
+    def new_connection(self, **kwargs):
+        """
+        Return a new pymysql connection to the database, extra keyword
+        arguments are given to pymysql.connect
+        """
+        return pymysql.connect(host=self.host,
+                               user=self.user,
+                               port=self.port,
+                               password=self.password,
+                               database=None,
+                               **kwargs)
+
     def connect(self):
         """
         connect to the database and set the connection attribute to
         pymysql.connect
         """
-        self.connection = pymysql.connect(host=self.host,
-                                          user=self.user,
-                                          port=self.port,
-                                          password=self.password,
-                                          database=None)
+        self.connection = self.new_connection()
         logging.debug("Successfully connected to mysql://%s:%s@%s:%s",
                       self.user, '*' * len(self.password), self.host,
                       self.port)
@@ -103,6 +186,18 @@ class DbBase():
         if self.connection.open:
             self.connection.close()
 
+    def clone(self):
+        """
+        Return a copy of the instance with its own connection to the database
+        so that it can be used from another thread. Cached cursors are bound
+        to the connection, the metadata are not shared with the clone.
+        """
+        clone = copy.copy(self)
+        clone.metadata = {}
+        clone.connection = None
+        clone.connect()
+        return clone
+
     def add_metadata(self, database=None, table=None, key=None, value=None):
         """
         store for one database/table a key with a value
@@ -131,6 +226,39 @@ class DbBase():
 
         return None
 
+    def get_limit(self, database=None, table=None, name=None):
+        """
+        Return the number of rows to handle per statement for a database.table
+        name is the limit option: select_limit, delete_limit or bulk_insert
+        The configured value is returned if target_statement_time is not set
+        """
+        if not self.target_statement_time:
+            return getattr(self, name)
+
+        key = (database, table, name)
+        if key not in self.adaptive_limits:
+            self.adaptive_limits[key] = AdaptiveLimit(
+                value=getattr(self, name),
+                target=self.target_statement_time,
+                minimum=self.adaptive_limit_min,
+                maximum=self.adaptive_limit_max)
+        return self.adaptive_limits[key].value
+
+    def update_limit(self,
+                     database=None,
+                     table=None,
+                     name=None,
+                     duration=None,
+                     rows=None):
+        """
+        Update the adaptive limit of a database.table with the duration of a
+        statement that handled the given number of rows
+        """
+        key = (database, table, name)
+        if key not in self.adaptive_limits:
+            return None
+        return self.adaptive_limits[key].update(duration=duration, rows=rows)
+
     def disable_fk_check(self, cursor=None):
         """
         Disable foreign key check for a cursor
@@ -272,7 +400,8 @@ class DbBase():
         start = timeit.default_timer()
         getattr(cursor, method)(sql, values)
         end = timeit.default_timer()
-        logging.debug("SQL duration: %s sec", end - start)
+        self.last_execute_duration = end - start
+        logging.debug("SQL duration: %s sec", self.last_execute_duration)
 
     def _db_fetch(self, fetch_method=None, cursor=None, fetch_args=None):
         """
@@ -293,13 +422,15 @@ class DbBase():
                 "[DRY RUN]: here is what I should have "
                 "commited: '%s'", cursor.mogrify(query=sql))
             self.connection.rollback()
+            self.last_commit_duration = 0
             return values_length
         # Not dry-run mode: commit the request
         # return the number of row affected by the request
         start = timeit.default_timer()
         self.connection.commit()
         end = timeit.default_timer()
-        logging.debug("Commit duration: %s sec", end - start)
+        self.last_commit_duration = end - start
+        logging.debug("Commit duration: %s sec", self.last_commit_duration)
         return cursor.rowcount
 
     def db_request(self,
@@ -413,19 +544,118 @@ class DbBase():
                                database=database,
                                fetch_method='fetchall')
 
+    def get_schema(self, database=None):
+        """
+        Return the schema snapshot of a database, load it on first call
+        """
+        if database not in self.schemas:
+            self.schemas[database] = self.load_schema(database=database)
+        return self.schemas[database]
+
+    def get_schema_fingerprint(self, database=None, refresh=False):
+        """
+        Return a cheap fingerprint of the schema of a database and the
+        estimated number of rows of its tables, computed once per run unless
+        refresh is True. The fingerprint is built from the tables names,
+        CREATE_TIME and options. An INSTANT or INPLACE ALTER does not change
+        CREATE_TIME, with metadata_cache_checksum the number of rows and a
+        checksum of the columns, indexes and foreign keys computed by the
+        server are added. UPDATE_TIME is not used as it changes with every
+        write.
+        """
+        if database in self.fingerprints and not refresh:
+            return self.fingerprints[database]
+        sql = "SELECT table_name, create_time, table_rows, engine, "\
+            "table_collation, create_options, table_comment FROM "\
+            "information_schema.tables WHERE table_schema='{db}' AND "\
+            "table_type='BASE TABLE' ORDER BY table_name".format(db=database)
+        result = self.db_request(sql=sql, fetch_method='fetchall')
+        fingerprint = hashlib.sha256()
+        for row in result:
+            fingerprint.update('{t}:{c}:{o};'.format(
+                t=row[0], c=row[1], o=row[3:]).encode())
+
+        if self.metadata_cache_checksum:
+            fingerprint.update(
+                str(self.get_schema_checksum(database=database)).encode())
+        self.fingerprints[database] = (fingerprint.hexdigest(),
+                                       {r[0]: int(r[2] or 0) for r in result})
+        return self.fingerprints[database]
+
+    def get_schema_checksum(self, database=None):
+        """
+        Return the number of rows and a checksum of the columns, indexes and
+        foreign keys of a database computed by the server, it scans the same
+        information_schema views as a schema snapshot
+        """
+        checksums = {
+            'columns': "table_name, column_name, ordinal_position, "
+                       "column_type, is_nullable, column_default, "
+                       "collation_name, extra, column_comment",
+            'statistics': "table_name, index_name, seq_in_index, "
+                          "column_name, non_unique, sub_part, index_type",
+            'key_column_usage': "table_name, constraint_name, "
+                                "ordinal_position, column_name, "
+                                "referenced_table_name, "
+                                "referenced_column_name",
+            'referential_constraints': "table_name, constraint_name, "
+                                       "update_rule, delete_rule"
+        }
+        sql = "SELECT {checksums}".format(checksums=', '.join([
+            "(SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS("
+            "'|', {columns}))), 0)) FROM information_schema.{view} WHERE "
+            "{schema_column}='{db}')".format(
+                columns=checksums[view],
+                view=view,
+                schema_column='constraint_schema'
+                if view == 'referential_constraints' else 'table_schema',
+                db=database) for view in sorted(checksums)
+        ]))
+        return self.db_request(sql=sql, fetch_method='fetchone')
+
+    def schema_cache_key(self, database=None):
+        """
+        Return the key of the schema of a database in the metadata cache
+        """
+        return 'schema:{host}:{port}/{db}'.format(host=self.host,
+                                                  port=self.port,
+                                                  db=database)
+
+    def load_schema(self, database=None):
+        """
+        Load the schema snapshot of a database. If a metadata cache is
+        configured, the cached snapshot is used when the fingerprint of the
+        schema did not change since it was cached.
+        """
+        if self.metadata_cache is None:
+            return Schema.load(db=self, database=database)
+
+        key = self.schema_cache_key(database=database)
+        (fingerprint, rows) = self.get_schema_fingerprint(database=database)
+        cached = self.metadata_cache.get(key=key)
+        if cached is not None and cached['fingerprint'] == fingerprint:
+            logging.debug("Using cached schema of %s", database)
+            schema = Schema.from_dict(cached['schema'])
+            # refresh the estimated number of rows
+            schema.tables = rows
+            return schema
+
+        logging.debug("Schema of %s is not cached or changed, loading it",
+                      database)
+        schema = Schema.load(db=self, database=database)
+        self.metadata_cache.set(key=key,
+                                value={
+                                    'fingerprint': fingerprint,
+                                    'schema': schema.to_dict()
+                                })
+        return schema
+
     def table_has_column(self, database=None, table=None, column=None):
         """
         Return True/False after checking that a column exists in a table
         """
-        sql = "SELECT column_name FROM information_schema.columns WHERE "\
-            "table_schema='{db}' and table_name='{table}' AND "\
-            "column_name='{column}'".format(
-                db=database, table=table, column=column)
-        return bool(
-            self.db_request(sql=sql,
-                            fetch_method='fetchall',
-                            database=database,
-                            table=table))
+        return self.get_schema(database=database).has_column(table=table,
+                                                             column=column)
 
     def table_has_deleted_column(self, database=None, table=None):
         """
@@ -435,28 +665,81 @@ class DbBase():
                                      table=table,
                                      column=self.deleted_column)
 
+    def get_table_primary_keys(self, database=None, table=None):
+        """
+        Return the list of the columns of the primary key of a table, in the
+        order of the index
+        """
+        primary_keys = self.get_schema(database=database).primary_keys(
+            table=table)
+        logging.debug("Primary key of %s.%s is %s", database, table,
+                      primary_keys)
+        return primary_keys
+
     def get_table_primary_key(self, database=None, table=None):
         """
         Return the first primary key of a table
-        Store the pk in metadata and return it if exists
-        """
-        primary_key = self.get_metadata(database=database,
-                                        table=table,
-                                        key='primary_key')
-        if primary_key is not None:
-            return primary_key
-
-        sql = "SHOW KEYS FROM {db}.{table} WHERE "\
-            "Key_name='PRIMARY'".format(db=database, table=table)
-        # Dirty but .... Column name is the 5 row
-        primary_key = self.db_request(sql=sql, fetch_method='fetchone')[4]
-        logging.debug("Primary key of %s.%s is %s", database, table,
-                      primary_key)
-        self.add_metadata(database=database,
-                          table=table,
-                          key='primary_key',
-                          value=primary_key)
-        return primary_key
+        """
+        return self.get_table_primary_keys(database=database, table=table)[0]
+
+    def sql_keys_greater_than(self, columns=None, values=None):
+        """
+        Return the SQL condition (c1, c2, ...) > (v1, v2, ...) written as
+        (c1 > v1 OR (c1 = v1 AND c2 > v2) OR ...) which is handled by the
+        range optimizer on all MySQL/MariaDB versions
+        """
+        conditions = []
+        for idx, column in enumerate(columns):
+            equals = [
+                "`{c}` = {v}".format(c=c, v=self.connection.escape(v))
+                for (c, v) in zip(columns[:idx], values[:idx])
+            ]
+            greater = "`{c}` > {v}".format(
+                c=column, v=self.connection.escape(values[idx]))
+            conditions.append(' AND '.join(equals + [greater]))
+        return '(' + ' OR '.join(
+            ['(' + c + ')' for c in conditions]) + ')'
+
+    def sql_keys_in(self, columns=None, values=None):
+        """
+        Return the SQL condition (c1, c2, ...) IN ((v1, v2, ...), ...) from a
+        list of tuples of values
+        """
+        return "({columns}) IN ({values})".format(
+            columns=', '.join(['`{c}`'.format(c=c) for c in columns]),
+            values=', '.join([
+                '(' + ', '.join([self.connection.escape(v)
+                                 for v in value]) + ')' for value in values
+            ]))
+
+    @staticmethod
+    def key_ranges(keys=None, min_length=3):
+        """
+        Coalesce integer keys into contiguous ranges. Return the list of
+        (first, last) ranges of at least min_length keys and the sorted list
+        of the keys which are not part of a range
+        """
+        runs = []
+        for key in sorted(set([int(k) for k in keys])):
+            if runs and key == runs[-1][1] + 1:
+                runs[-1][1] = key
+            else:
+                runs.append([key, key])
+        ranges = []
+        singles = []
+        for (first, last) in runs:
+            if last - first + 1 >= min_length:
+                ranges.append((first, last))
+            else:
+                singles.extend(range(first, last + 1))
+        return (ranges, singles)
+
+    def get_tables_rows_estimate(self, database=None):
+        """
+        Return a dict of the estimated number of rows of each table of a
+        database, as reported by information_schema
+        """
+        return dict(self.get_schema(database=database).tables)
 
     def get_tables_with_fk(self, database=None, table=None):
         """
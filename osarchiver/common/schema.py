@@ -0,0 +1,311 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Schema class file which provide a snapshot of the schema of a database
+
+The snapshot is loaded with a few information_schema queries for the whole
+database: tables, columns, indexes (including the primary key) and foreign
+keys. All the schema lookups are then served from memory.
+"""
+
+import hashlib
+import json
+import logging
+
+INTEGER_TYPES = ['tinyint', 'smallint', 'mediumint', 'int', 'bigint']
+
+
+class Schema():
+    """
+    Snapshot of the schema of one database
+    """
+
+    def __init__(self,
+                 database=None,
+                 tables=None,
+                 columns=None,
+                 indexes=None,
+                 foreign_keys=None,
+                 options=None):
+        """
+        instantiator
+        :param str database: the name of the database
+        :param dict tables: table name -> estimated number of rows
+        :param dict columns: table name -> list of columns, a column is a dict
+        with name, data_type, column_type, nullable, default, collation, extra
+        and comment keys
+        :param dict indexes: table name -> index name -> dict with columns
+        (ordered list), sub_parts (prefix lengths), unique and type keys
+        :param list foreign_keys: list of dict with name, table, columns,
+        referenced_schema, referenced_table, referenced_columns, update_rule
+        and delete_rule keys
+        :param dict options: table name -> dict with engine, collation,
+        create_options and comment keys
+        """
+        self.database = database
+        self.tables = tables or {}
+        self.columns = columns or {}
+        self.indexes = indexes or {}
+        self.foreign_keys = foreign_keys or []
+        self.options = options or {}
+
+    def __repr__(self):
+        return "Schema {db} [{count} tables]".format(db=self.database,
+                                                     count=len(self.tables))
+
+    @classmethod
+    def load(cls, db=None, database=None):
+        """
+        Load the snapshot of a database using the db_request method of a
+        DbBase instance
+        """
+        schema = cls(database=database)
+
+        sql = "SELECT table_name, table_rows, engine, table_collation, "\
+            "create_options, table_comment FROM information_schema.tables "\
+            "WHERE table_schema='{db}' AND "\
+            "table_type='BASE TABLE'".format(db=database)
+        for (table, rows, engine, collation, create_options, comment) in \
+                db.db_request(sql=sql, fetch_method='fetchall'):
+            schema.tables[table] = int(rows or 0)
+            schema.options[table] = {
+                'engine': engine,
+                'collation': collation,
+                'create_options': create_options,
+                'comment': comment
+            }
+
+        sql = "SELECT table_name, column_name, data_type, column_type, "\
+            "is_nullable, column_default, collation_name, extra, "\
+            "column_comment FROM information_schema.columns WHERE "\
+            "table_schema='{db}' ORDER BY table_name, "\
+            "ordinal_position".format(db=database)
+        for (table, column, data_type, column_type, nullable, default,
+             collation, extra, comment) in \
+                db.db_request(sql=sql, fetch_method='fetchall'):
+            schema.columns.setdefault(table, []).append({
+                'name': column,
+                'data_type': str(data_type).lower(),
+                'column_type': str(column_type).lower(),
+                'nullable': nullable == 'YES',
+                'default': None if default is None else str(default),
+                'collation': collation,
+                'extra': extra,
+                'comment': comment
+            })
+
+        sql = "SELECT table_name, index_name, column_name, non_unique, "\
+            "sub_part, index_type FROM information_schema.statistics WHERE "\
+            "table_schema='{db}' ORDER BY table_name, index_name, "\
+            "seq_in_index".format(db=database)
+        for (table, index, column, non_unique, sub_part, index_type) in \
+                db.db_request(sql=sql, fetch_method='fetchall'):
+            table_indexes = schema.indexes.setdefault(table, {})
+            description = table_indexes.setdefault(
+                index, {
+                    'columns': [],
+                    'sub_parts': [],
+                    'unique': not int(non_unique),
+                    'type': index_type
+                })
+            description['columns'].append(column)
+            description['sub_parts'].append(
+                None if sub_part is None else int(sub_part))
+
+        sql = "SELECT constraint_name, table_name, column_name, "\
+            "referenced_table_schema, referenced_table_name, "\
+            "referenced_column_name FROM information_schema.key_column_usage "\
+            "WHERE table_schema='{db}' AND referenced_table_name IS NOT NULL "\
+            "ORDER BY table_name, constraint_name, "\
+            "ordinal_position".format(db=database)
+        foreign_keys = {}
+        for (name, table, column, ref_schema, ref_table, ref_column) in \
+                db.db_request(sql=sql, fetch_method='fetchall'):
+            foreign_key = foreign_keys.setdefault((table, name), {
+                'name': name,
+                'table': table,
+                'columns': [],
+                'referenced_schema': ref_schema,
+                'referenced_table': ref_table,
+                'referenced_columns': []
+            })
+            foreign_key['columns'].append(column)
+            foreign_key['referenced_columns'].append(ref_column)
+
+        sql = "SELECT table_name, constraint_name, update_rule, "\
+            "delete_rule FROM information_schema.referential_constraints "\
+            "WHERE constraint_schema='{db}'".format(db=database)
+        for (table, name, update_rule, delete_rule) in \
+                db.db_request(sql=sql, fetch_method='fetchall'):
+            if (table, name) in foreign_keys:
+                foreign_keys[(table, name)]['update_rule'] = update_rule
+                foreign_keys[(table, name)]['delete_rule'] = delete_rule
+        schema.foreign_keys = list(foreign_keys.values())
+
+        logging.debug("Loaded schema of %s: %s tables, %s foreign keys",
+                      database, len(schema.tables), len(schema.foreign_keys))
+        return schema
+
+    def to_dict(self):
+        """
+        Return the snapshot as a dict which can be serialized in JSON
+        """
+        return {
+            'database': self.database,
+            'tables': self.tables,
+            'columns': self.columns,
+            'indexes': self.indexes,
+            'foreign_keys': self.foreign_keys,
+            'options': self.options
+        }
+
+    @classmethod
+    def from_dict(cls, data=None):
+        """
+        Return a snapshot from a dict returned by to_dict
+        """
+        return cls(**data)
+
+    def table_names(self):
+        """
+        Return the list of tables of the database
+        """
+        return sorted(self.tables)
+
+    def rows_estimate(self, table=None):
+        """
+        Return the estimated number of rows of a table
+        """
+        return self.tables.get(table, 0)
+
+    def column_names(self, table=None):
+        """
+        Return the list of columns of a table
+        """
+        return [c['name'] for c in self.columns.get(table, [])]
+
+    def column(self, table=None, column=None):
+        """
+        Return the description of a column, None if it does not exist
+        """
+        for description in self.columns.get(table, []):
+            if description['name'] == column:
+                return description
+        return None
+
+    def has_column(self, table=None, column=None):
+        """
+        Return True/False if the column exists in the table
+        """
+        return self.column(table=table, column=column) is not None
+
+    def primary_keys(self, table=None):
+        """
+        Return the list of columns of the primary key of a table
+        """
+        return list(
+            self.indexes.get(table, {}).get('PRIMARY', {}).get('columns', []))
+
+    def primary_key_is_integer(self, table=None):
+        """
+        Return True if the primary key of a table is made of one integer
+        column
+        """
+        primary_keys = self.primary_keys(table=table)
+        if len(primary_keys) != 1:
+            return False
+        column = self.column(table=table, column=primary_keys[0])
+        return column is not None and column['data_type'] in INTEGER_TYPES
+
+    def index_starting_with(self, table=None, column=None):
+        """
+        Return the name of the index of a table whose first column is the
+        given column, the one with the fewest columns if there are several,
+        None if there is none
+        """
+        candidates = [(len(index['columns']), name)
+                      for (name, index) in self.indexes.get(table, {}).items()
+                      if index['columns'][0] == column]
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def definition(self, table=None):
+        """
+        Return the definition of a table as compared by SHOW CREATE TABLE,
+        independent of the names of the table and of its database: columns,
+        indexes, foreign keys and table options. AUTO_INCREMENT is not part
+        of it, neither are the partitions.
+        """
+        foreign_keys = []
+        for foreign_key in self.foreign_keys:
+            if foreign_key['table'] != table:
+                continue
+            foreign_key = dict(foreign_key)
+            del foreign_key['table']
+            # a reference to the same database is written without the name
+            # of the database
+            if foreign_key['referenced_schema'] == self.database:
+                foreign_key['referenced_schema'] = None
+            foreign_keys.append(foreign_key)
+        options = dict(self.options.get(table, {}))
+        options['create_options'] = ' '.join([
+            o for o in str(options.get('create_options') or '').split()
+            if o.lower() != 'partitioned'
+        ])
+        return {
+            'columns': self.columns.get(table, []),
+            'indexes': self.indexes.get(table, {}),
+            'foreign_keys': sorted(foreign_keys, key=lambda fk: fk['name']),
+            'options': options
+        }
+
+    @staticmethod
+    def hash_definition(definition=None):
+        """
+        Return a hash of a table definition returned by definition()
+        """
+        return hashlib.sha256(
+            json.dumps(definition, sort_keys=True,
+                       default=str).encode()).hexdigest()
+
+    def definition_hash(self, table=None):
+        """
+        Return a hash of the definition of a table, two tables with the same
+        hash have the same structure
+        """
+        return self.hash_definition(definition=self.definition(table=table))
+
+    def foreign_keys_of(self, table=None):
+        """
+        Return the foreign keys of a table, (references to its parents) in
+        the same database
+        """
+        return [
+            fk for fk in self.foreign_keys if fk['table'] == table
+            and fk['referenced_schema'] == self.database
+        ]
+
+    def blocking_foreign_keys(self, table=None):
+        """
+        Return the foreign keys of other tables of the database that prevent
+        the deletion of the rows of a table they reference, those whose
+        delete rule is neither CASCADE nor SET NULL
+        """
+        return [
+            fk for fk in self.foreign_keys_referencing(table=table)
+            if fk['table'] != table and fk.get('delete_rule', 'RESTRICT') not in
+            ['CASCADE', 'SET NULL', 'SET DEFAULT']
+        ]
+
+    def foreign_keys_referencing(self, table=None):
+        """
+        Return the foreign keys of the database that reference a table
+        (references from its children)
+        """
+        return [
+            fk for fk in self.foreign_keys
+            if fk['referenced_table'] == table
+            and fk['referenced_schema'] == self.database
+        ]
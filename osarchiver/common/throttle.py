@@ -0,0 +1,186 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Throttle class file which paces the deletes depending on the load of the
+database server
+
+Between two deletes the server is sampled: number of running threads, InnoDB
+history list length, replication lag and Galera flow control. The delay
+between deletes and the size of the deletes are adjusted within configured
+bounds: the delay doubles and the size halves while the server is overloaded,
+and they come back towards their initial values once it is idle again.
+"""
+
+import logging
+import threading
+import time
+import pymysql
+
+# errors of a sampling query meaning that the server can't provide the metric
+# (unknown table or variable, access denied), the other errors are transient
+UNSUPPORTED_METRIC_ERRORS = [1044, 1045, 1109, 1142, 1143, 1146, 1193, 1227]
+
+
+class Throttle():
+    """
+    Load aware pacing of the deletes, shared by the clones of a Source
+    """
+
+    def __init__(self,
+                 min_delay=0,
+                 max_delay=60,
+                 max_threads_running=50,
+                 max_history_length=1000000,
+                 max_replication_lag=10,
+                 max_flow_control=0.1,
+                 min_chunk_ratio=0.1,
+                 sample_interval=1):
+        """
+        instantiator, take the bounds of the delay in seconds, the limits of
+        the metrics above which the server is overloaded (0 to ignore a
+        metric), the minimal ratio of the chunk size and the minimal number
+        of seconds between two samples
+        """
+        self.min_delay = float(min_delay)
+        self.max_delay = float(max_delay)
+        self.limits = {
+            'threads_running': float(max_threads_running),
+            'history_length': float(max_history_length),
+            'replication_lag': float(max_replication_lag),
+            'flow_control': float(max_flow_control)
+        }
+        self.min_chunk_ratio = float(min_chunk_ratio)
+        self.sample_interval = float(sample_interval)
+        self.current_delay = self.min_delay
+        self.chunk_ratio = 1.0
+        self.last_sample_time = None
+        self.last_load = 0
+        # metrics the server can't provide, they are not sampled anymore
+        self.unavailable = set()
+        # last value of each metric, kept while its sampling fails
+        self.last_metrics = {}
+        # metrics whose last sampling failed
+        self.failed = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Throttle [delay:{delay}s chunk:{ratio}]".format(
+            delay=self.current_delay, ratio=self.chunk_ratio)
+
+    def _query(self, connection=None, name=None, sql=None):
+        """
+        Run a sampling query and return all its rows, None if it failed. A
+        metric the server can't provide is disabled for the rest of the run,
+        after another error it is sampled again the next time
+        """
+        if name in self.unavailable:
+            return None
+        try:
+            with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+                cursor.execute(sql)
+                return cursor.fetchall()
+        except pymysql.ProgrammingError as sql_exception:
+            logging.warning("Unable to sample %s, ignoring it: %s", name,
+                            sql_exception.args)
+            self.unavailable.add(name)
+        except pymysql.Error as sql_exception:
+            if sql_exception.args and \
+                    sql_exception.args[0] in UNSUPPORTED_METRIC_ERRORS:
+                logging.warning("Unable to sample %s, ignoring it: %s", name,
+                                sql_exception.args)
+                self.unavailable.add(name)
+            else:
+                logging.warning("Unable to sample %s, keeping its last "
+                                "value: %s", name, sql_exception.args)
+                self.failed.add(name)
+        return None
+
+    def sample(self, connection=None):
+        """
+        Return a dict of the metrics of the server, the metrics not
+        available are not in the dict. A metric whose sampling failed keeps
+        its last value
+        """
+        metrics = {}
+        self.failed = set()
+        rows = self._query(connection=connection,
+                           name='threads_running',
+                           sql="SHOW GLOBAL STATUS LIKE 'Threads_running'")
+        if rows:
+            metrics['threads_running'] = float(rows[0]['Value'])
+
+        rows = self._query(
+            connection=connection,
+            name='history_length',
+            sql="SELECT count FROM information_schema.innodb_metrics "
+            "WHERE name = 'trx_rseg_history_len'")
+        if rows:
+            metrics['history_length'] = float(rows[0]['count'])
+
+        rows = self._query(connection=connection,
+                           name='replication_lag',
+                           sql="SHOW SLAVE STATUS")
+        if rows and rows[0].get('Seconds_Behind_Master') is not None:
+            metrics['replication_lag'] = float(
+                rows[0]['Seconds_Behind_Master'])
+
+        rows = self._query(
+            connection=connection,
+            name='flow_control',
+            sql="SHOW GLOBAL STATUS LIKE 'wsrep_flow_control_paused'")
+        if rows:
+            metrics['flow_control'] = float(rows[0]['Value'])
+
+        for name in self.failed:
+            if name in self.last_metrics:
+                metrics[name] = self.last_metrics[name]
+        self.last_metrics = metrics
+        return metrics
+
+    def load(self, connection=None):
+        """
+        Return the load of the server: the highest ratio between a metric
+        and its limit, more than 1 means the server is overloaded. The server
+        is sampled at most once per sample_interval seconds.
+        """
+        now = time.time()
+        if self.last_sample_time is not None and \
+                now - self.last_sample_time < self.sample_interval:
+            return self.last_load
+        metrics = self.sample(connection=connection)
+        ratios = [
+            metrics[m] / self.limits[m] for m in metrics if self.limits[m] > 0
+        ]
+        self.last_load = max(ratios or [0])
+        self.last_sample_time = now
+        logging.debug("Server load %s: %s", round(self.last_load, 2), metrics)
+        return self.last_load
+
+    def delay(self, connection=None):
+        """
+        Sample the server and return the number of seconds to wait before
+        the next delete, the chunk size is adjusted at the same time
+        """
+        with self._lock:
+            load = self.load(connection=connection)
+            if load > 1:
+                self.current_delay = min(
+                    self.max_delay, max(self.current_delay * 2, 1,
+                                        self.min_delay))
+                self.chunk_ratio = max(self.min_chunk_ratio,
+                                       self.chunk_ratio / 2)
+                logging.info("Server overloaded (load %s), deletes slowed "
+                             "down: %s", round(load, 2), self)
+            elif load < 0.5:
+                self.current_delay = max(self.min_delay,
+                                         self.current_delay / 2)
+                self.chunk_ratio = min(1.0, self.chunk_ratio * 2)
+            return self.current_delay
+
+    def chunk_size(self, limit=None):
+        """
+        Return the number of rows to delete at once from the configured one
+        """
+        with self._lock:
+            return max(1, int(int(limit) * self.chunk_ratio))
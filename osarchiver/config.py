@@ -5,15 +5,21 @@
 Configuration class to handle osarchiver config
 """
 
+import os
 import re
 import logging
 import configparser
 
 from osarchiver.archiver import Archiver
+from osarchiver.checkpoint import Checkpoint
 from osarchiver.destination import factory as dst_factory
 from osarchiver.source import factory as src_factory
 
-BOOLEAN_OPTIONS = ['delete_data', 'archive_data', 'enable', 'foreign_key_check']
+BOOLEAN_OPTIONS = ['delete_data', 'archive_data', 'enable', 'foreign_key_check',
+                   'select_streaming', 'skip_empty_tables',
+                   'check_blocking_children', 'delete_by_range', 'throttle',
+                   'server_side_copy', 'partition_by_month',
+                   'metadata_cache_checksum']
 
 
 class Config():
@@ -22,7 +28,7 @@ class Config():
     Archivers to be run
     """
 
-    def __init__(self, file_path=None, dry_run=False):
+    def __init__(self, file_path=None, dry_run=False, resume=False):
         self.file_path = file_path
         """
         Config class instantiator. Instantiate a configparser
@@ -34,6 +40,7 @@ class Config():
         self._sources = []
         self._destinations = []
         self.dry_run = dry_run
+        self.resume = resume
 
     def load(self, file_path=None):
         """
@@ -147,11 +154,33 @@ class Config():
                     dst = dst_factory(**dst_args_factory)
                     destinations.append(dst)
 
+                name = re.sub('^archiver:', '', archiver)
+                # Nothing is written or deleted in dry-run mode, there is no
+                # progress to save
+                checkpoint = None
+                checkpoint_file = self.parser[archiver].get('checkpoint_file')
+                if checkpoint_file and not self.dry_run:
+                    checkpoint_file = checkpoint_file.format(
+                        archiver=name, src=src.name)
+                    os.makedirs(os.path.dirname(checkpoint_file) or '.',
+                                exist_ok=True)
+                    checkpoint = Checkpoint(
+                        path=checkpoint_file,
+                        name='{archiver}:{src}'.format(archiver=name,
+                                                       src=src.name))
+
                 self._archivers.append(
-                    Archiver(name=re.sub('^archiver:', '', archiver),
+                    Archiver(name=name,
                              src=src,
                              dst=destinations,
-                             conf=self))
+                             conf=self,
+                             workers=self.parser[archiver].get('workers', 1),
+                             checkpoint=checkpoint,
+                             resume=self.resume,
+                             pipeline=self.parser.getboolean(
+                                 archiver, 'pipeline', fallback=False),
+                             pipeline_depth=self.parser[archiver].get(
+                                 'pipeline_depth', 2)))
 
         return self._archivers
 
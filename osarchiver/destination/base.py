@@ -28,6 +28,46 @@ class Destination(metaclass=ABCMeta):
         Write method that should be implemented by the backend
         """
 
+    def needs_rows(self):
+        """
+        Return True if the destination needs the content of the rows to
+        archive them, False if the keys of the rows are enough
+        """
+        return True
+
+    def files(self):
+        """
+        Return the list of files written by the destination, if any
+        """
+        return []
+
+    def file_sizes(self):
+        """
+        Return a dict of the files written by the destination and of their
+        size durable on the disk, None if nothing in the file is
+        """
+        return {}
+
+    def flush(self, database=None, table=None, data=None):
+        """
+        Make a set of data written durable before it is deleted from the
+        Source and recorded in a checkpoint. Nothing to do by default.
+        """
+
+    def checkpointed(self, files=None):
+        """
+        Called once the files and their durable size are saved in a
+        checkpoint, the files not needed anymore to resume may be removed.
+        Nothing to do by default.
+        """
+
+    def adopt_files(self, files=None):
+        """
+        Take over the files left by an interrupted run, a dict of the files
+        and of their durable size, the destination is in charge of finishing
+        them. Nothing to do by default.
+        """
+
     @abstractmethod
     def clean_exit(self):
         """
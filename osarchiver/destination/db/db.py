@@ -6,15 +6,85 @@ This module implements the database destination backend which handle writing
 data into a MySQL/MariaDB backend
 """
 
+import copy
+import datetime
 import logging
 import difflib
+import os
 import re
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import arrow
 from osarchiver.destination import Destination
 from osarchiver.common.db import DbBase
+from osarchiver.common.schema import Schema
 from . import errors as db_errors
 
+# error code of the duplicate key warnings of LOAD DATA IGNORE
+DUPLICATE_ENTRY_ERROR = 1062
+
+
+class WriterPool():
+    """
+    Pool of writer threads of a Db destination, each writer has its own
+    connection to the destination. The writes of a table always go to the
+    same writer so that they are done in order, the writes of different
+    tables are done concurrently.
+    """
+
+    def __init__(self, destination=None, size=1):
+        """
+        instantiator, take the destination whose connection is cloned for
+        each writer and the number of writers, which are started on first use
+        """
+        self.destination = destination
+        self.size = int(size)
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "WriterPool {count}/{size} writers".format(
+            count=len(self._writers), size=self.size)
+
+    def writer(self, database=None, table=None):
+        """
+        Return the executor and the destination clone of the writer of a
+        table
+        """
+        index = zlib.crc32('{db}.{table}'.format(
+            db=database, table=table).encode()) % self.size
+        with self._lock:
+            if index not in self._writers:
+                logging.debug("Starting writer %s of %s", index,
+                              self.destination.name)
+                self._writers[index] = (ThreadPoolExecutor(max_workers=1),
+                                        DbBase.clone(self.destination))
+            return self._writers[index]
+
+    def submit(self, database=None, table=None, **kwargs):
+        """
+        Submit the write of a set of rows of a table to its writer, return
+        the future of the write
+        """
+        (executor, destination) = self.writer(database=database, table=table)
+        return executor.submit(destination.write_values,
+                               database=database,
+                               table=table,
+                               **kwargs)
+
+    def close(self):
+        """
+        Wait for the pending writes and close the connections of the writers
+        """
+        with self._lock:
+            for (executor, destination) in self._writers.values():
+                executor.shutdown(wait=True)
+                destination.disconnect()
+            self._writers = {}
+
 
 class Db(Destination, DbBase):
     """
@@ -29,6 +99,13 @@ class Db(Destination, DbBase):
                  db_suffix='',
                  table_suffix='',
                  database=None,
+                 server_side_copy=False,
+                 bulk_loader='insert',
+                 load_data_duplicates='ignore',
+                 writers=1,
+                 partition_by_month=False,
+                 partition_future_months=3,
+                 partition_retention_months=0,
                  **kwargs):
         """
         instance osarchiver.destination.Db class backend
@@ -43,13 +120,84 @@ class Db(Destination, DbBase):
         self.db_suffix = db_suffix
         self.table_suffix = table_suffix
         self.normalized_db_suffixes = {}
+        # copy the rows with INSERT ... SELECT when the archive database is
+        # on the source server
+        self.server_side_copy = server_side_copy
+        # how rows are written: insert (executemany of INSERT statements) or
+        # load_data (LOAD DATA LOCAL INFILE of a TSV file)
+        if bulk_loader not in ['insert', 'load_data']:
+            raise ValueError(
+                "Unsupported bulk_loader '{}'".format(bulk_loader))
+        self.bulk_loader = bulk_loader
+        # what LOAD DATA does of rows already archived: ignore or replace
+        if load_data_duplicates not in ['ignore', 'replace']:
+            raise ValueError("Unsupported load_data_duplicates '{}'".format(
+                load_data_duplicates))
+        self.load_data_duplicates = load_data_duplicates
+        # number of rows of the LOAD DATA being executed, checked before it
+        # is committed
+        self.load_data_rows = None
+        # archive tables RANGE partitioned by month of the deleted column,
+        # with partitions created in advance and expired ones dropped
+        self.partition_by_month = partition_by_month
+        self.partition_future_months = int(partition_future_months)
+        self.partition_retention_months = int(partition_retention_months)
+        # (database, table) whose partitions were maintained during the run
+        self.maintained_tables = set()
+        # INSERT statements per (archive db, archive table, columns)
+        self.insert_templates = {}
+        # (database, table) whose archive table is checked, and databases
+        # whose archive tables were checked in one pass, shared with the
+        # clones for the whole run
+        self.checked_tables = set()
+        self.checked_databases = set()
+        self.prerequisites_lock = threading.Lock()
+        self.cloned = False
         Destination.__init__(self, backend='db', name=name)
         DbBase.__init__(self, **kwargs)
+        # pool of writers with their own connections shared with the clones
+        self.writer_pool = None
+        if int(writers) > 1:
+            self.writer_pool = WriterPool(destination=self, size=writers)
 
     def __repr__(self):
         return "Destination {name} [Backend:{backend} - Host:{host}]".format(
             backend=self.backend, host=self.host, name=self.name)
 
+    def clone(self, source=None):
+        """
+        Return a copy of the destination with its own connection, bound to
+        the given Source instance (a clone of the source most of the time)
+        """
+        clone = DbBase.clone(self)
+        clone.cloned = True
+        if source is not None:
+            clone.source = source
+        return clone
+
+    def new_connection(self, **kwargs):
+        """
+        Return a new connection, allowed to load local files and without
+        unique checks in load_data mode
+        """
+        if self.bulk_loader == 'load_data':
+            kwargs.setdefault('local_infile', True)
+            kwargs.setdefault('init_command', 'SET SESSION unique_checks = 0')
+        return DbBase.new_connection(self, **kwargs)
+
+    def same_server(self):
+        """
+        Return True if the destination is the server of the source
+        """
+        return self.source.host == self.host and \
+            self.source.port == self.port
+
+    def needs_rows(self):
+        """
+        The rows are not needed when they are copied by the server
+        """
+        return not (self.server_side_copy and self.same_server())
+
     def normalize_db_suffix(self, db_suffix='', database=None):
         """
         Return the name of the suffix that should be added to database name to
@@ -123,6 +271,13 @@ class Db(Destination, DbBase):
             self.normalize_db_suffix(database=database)
         return self.archive_db_name
 
+    def get_archive_table_name(self, table=None):
+        """
+        Return the name of the archiving table, which is build from the name
+        of the source table plus a suffix
+        """
+        return table + self.normalize_table_suffix()
+
     def archive_db_exists(self, database=None):
         """
         Check if a databae already exists, return True/False
@@ -208,7 +363,7 @@ class Db(Destination, DbBase):
         """
         Check if the archiving tabel exists, return True or False
         """
-        self.archive_table_name = table + self.normalize_table_suffix()
+        self.archive_table_name = self.get_archive_table_name(table=table)
         show_table_sql = 'SHOW TABLES LIKE '\
             '\'{table}\''.format(table=self.archive_table_name)
         return bool(
@@ -298,12 +453,23 @@ class Db(Destination, DbBase):
         # else use the statement to create it
         src_create_table_statement = self.get_src_create_table_statement(
             database=database, table=table)
+        if self.partition_by_month:
+            src_create_table_statement = \
+                self.partitioned_create_table_statement(
+                    statement=src_create_table_statement)
 
         if archive_table_exists:
             logging.debug("Remote DB has '%s.%s' table", self.archive_db_name,
                           self.archive_table_name)
             dst_table_create_statement = self.get_dst_create_table_statement(
                 database=self.archive_db_name, table=self.archive_table_name)
+            if self.partition_by_month:
+                # the partitions change from one run to another
+                dst_table_create_statement = re.sub(
+                    r'\s*(/\*!\d+\s*)?PARTITION BY .*\Z',
+                    '',
+                    dst_table_create_statement,
+                    flags=re.S)
             self.compare_src_and_dst_create_table_statement(
                 src_statement=src_create_table_statement,
                 dst_statement=dst_table_create_statement,
@@ -316,6 +482,8 @@ class Db(Destination, DbBase):
                 'TABLE `{table}`'.format(table=table),
                 'TABLE `{table}`'.format(table=self.archive_table_name),
                 src_create_table_statement)
+            if self.partition_by_month:
+                sql += ' ' + self.partitions_clause()
             self.db_request(sql=sql,
                             database=self.archive_db_name,
                             foreign_key_check=False)
@@ -324,25 +492,318 @@ class Db(Destination, DbBase):
                 logging.debug("Successfully created '%s.%s'",
                               self.archive_db_name, self.archive_table_name)
 
+    def partitioned_create_table_statement(self, statement=None):
+        """
+        Return the CREATE TABLE statement of an archive table partitioned by
+        month of the deleted column from the statement of the source table,
+        without its partitions. Every unique key of a partitioned table must
+        contain the partitioning column and foreign keys are not supported:
+        - the deleted column is NOT NULL and added to the primary key
+        - the other unique keys become simple keys
+        - the foreign keys are removed
+        """
+        column = self.source.deleted_column
+        lines = statement.split('\n')
+        definitions = []
+        for line in lines[1:-1]:
+            definition = line.strip().rstrip(',')
+            if re.match(r'CONSTRAINT `[^`]+` FOREIGN KEY', definition):
+                continue
+            if definition.startswith('`{c}` '.format(c=column)):
+                definition = re.sub(r' (DEFAULT NULL|(?<!NOT )NULL)\b', '',
+                                    definition)
+                if 'NOT NULL' not in definition:
+                    definition += ' NOT NULL'
+            match = re.match(r'PRIMARY KEY \(((?:[^()]|\([^()]*\))*)\)',
+                             definition)
+            if match and '`{c}`'.format(c=column) not in match.group(1):
+                definition = 'PRIMARY KEY ({columns},`{c}`){end}'.format(
+                    columns=match.group(1),
+                    c=column,
+                    end=definition[match.end():])
+            definition = re.sub(r'^UNIQUE KEY ', 'KEY ', definition)
+            definitions.append('  ' + definition)
+        return '\n'.join([lines[0], ',\n'.join(definitions), lines[-1]])
+
+    def partitioned_definition(self, definition=None):
+        """
+        Return the definition of an archive table partitioned by month, as
+        returned by Schema.definition, from the one of the source table with
+        the changes of partitioned_create_table_statement
+        """
+        column = self.source.deleted_column
+        definition = copy.deepcopy(definition)
+        for description in definition['columns']:
+            if description['name'] == column:
+                description['nullable'] = False
+                description['default'] = None
+        for (name, index) in definition['indexes'].items():
+            if name == 'PRIMARY':
+                if column not in index['columns']:
+                    index['columns'].append(column)
+                    index['sub_parts'].append(None)
+            else:
+                index['unique'] = False
+        definition['foreign_keys'] = []
+        return definition
+
+    @staticmethod
+    def add_months(day=None, months=0):
+        """
+        Return the first day of the month of a date plus a number of months
+        """
+        index = day.year * 12 + day.month - 1 + months
+        return datetime.date(index // 12, index % 12 + 1, 1)
+
+    @staticmethod
+    def to_days(day=None):
+        """
+        Return the TO_DAYS() value of MySQL of a date
+        """
+        return day.toordinal() + 365
+
+    @staticmethod
+    def from_days(days=None):
+        """
+        Return the date of a TO_DAYS() value of MySQL
+        """
+        return datetime.date.fromordinal(days - 365)
+
+    def partition_changes(self, bounds=None, today=None):
+        """
+        Return the months whose partitions are to add, up to
+        partition_future_months months after the current one, and the names
+        of the partitions whose rows are all older than the retention, from
+        the list of (name, upper bound) of the partitions of a table, the
+        bound being None for MAXVALUE
+        """
+        current = self.add_months(day=today)
+        bounded = [b for (n, b) in bounds if b is not None]
+        month = max(bounded) if bounded else current
+        last = self.add_months(day=current,
+                               months=self.partition_future_months + 1)
+        months = []
+        while month < last:
+            months.append(month)
+            month = self.add_months(day=month, months=1)
+
+        expired = []
+        if self.partition_retention_months > 0:
+            expiry = self.add_months(day=current,
+                                     months=-self.partition_retention_months)
+            expired = [n for (n, b) in bounds if b is not None and b <= expiry]
+        return (months, expired)
+
+    def partition_definition(self, month=None):
+        """
+        Return the definition of the partition of a month
+        """
+        return "PARTITION p{name} VALUES LESS THAN ({bound})".format(
+            name=month.strftime('%Y%m'),
+            bound=self.to_days(self.add_months(day=month, months=1)))
+
+    def partitions_clause(self):
+        """
+        Return the PARTITION BY clause of a new archive table: one partition
+        per month from the retention limit (or the current month) to
+        partition_future_months months ahead, a partition of the older rows
+        and a partition of the rows beyond the last month
+        """
+        current = self.add_months(day=datetime.date.today())
+        first = self.add_months(day=current,
+                                months=-self.partition_retention_months)
+        months = [
+            self.add_months(day=first, months=m)
+            for m in range(self.partition_retention_months +
+                           self.partition_future_months + 1)
+        ]
+        partitions = ["PARTITION pold VALUES LESS THAN ({bound})".format(
+            bound=self.to_days(first))]
+        partitions += [self.partition_definition(month=m) for m in months]
+        partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        return "PARTITION BY RANGE (TO_DAYS(`{column}`)) ({partitions})".format(
+            column=self.source.deleted_column,
+            partitions=', '.join(partitions))
+
+    def maintain_partitions(self, database=None, table=None):
+        """
+        Maintain the partitions of the archive table of a table: the
+        partitions of the next partition_future_months months are added by
+        splitting the pmax partition and, if partition_retention_months is
+        set, the partitions whose rows are all older than the retention are
+        dropped, which is near-instant compared to a DELETE
+        """
+        archive_db = self.get_archive_db_name(database=database)
+        archive_table = self.get_archive_table_name(table=table)
+        sql = "SELECT partition_name, partition_description FROM "\
+            "information_schema.partitions WHERE table_schema='{db}' AND "\
+            "table_name='{table}' AND partition_name IS NOT NULL ORDER BY "\
+            "partition_ordinal_position".format(db=archive_db,
+                                                table=archive_table)
+        partitions = self.db_request(sql=sql, fetch_method='fetchall')
+        if not partitions:
+            logging.warning(
+                "%s.%s is not partitioned, it was created before "
+                "partition_by_month was set", archive_db, archive_table)
+            return
+        # upper bound of each partition, None for MAXVALUE
+        bounds = [(name, self.from_days(days=int(description))
+                   if str(description).isdigit() else None)
+                  for (name, description) in partitions]
+        (months, expired) = self.partition_changes(
+            bounds=bounds, today=datetime.date.today())
+
+        definitions = [self.partition_definition(month=m) for m in months]
+        if definitions:
+            if bounds[-1][1] is None:
+                sql = "ALTER TABLE `{table}` REORGANIZE PARTITION `{pmax}` "\
+                    "INTO ({partitions}, PARTITION `{pmax}` VALUES LESS "\
+                    "THAN MAXVALUE)".format(table=archive_table,
+                                            pmax=bounds[-1][0],
+                                            partitions=', '.join(definitions))
+            else:
+                sql = "ALTER TABLE `{table}` ADD PARTITION "\
+                    "({partitions})".format(table=archive_table,
+                                            partitions=', '.join(definitions))
+            self.partition_request(sql=sql, database=archive_db)
+            logging.info("%s partitions added to %s.%s", len(definitions),
+                         archive_db, archive_table)
+
+        if expired:
+            sql = "ALTER TABLE `{table}` DROP PARTITION {partitions}".format(
+                table=archive_table,
+                partitions=', '.join(['`{p}`'.format(p=p) for p in expired]))
+            self.partition_request(sql=sql, database=archive_db)
+            logging.info("Partitions %s of %s.%s expired", ', '.join(expired),
+                         archive_db, archive_table)
+
+    def partition_request(self, sql=None, database=None):
+        """
+        Run an ALTER TABLE of the partitions, only displayed in dry run mode
+        as it can not be rolled back
+        """
+        if self.dry_run:
+            logging.info("[DRY RUN]: here is what I should have run: '%s'",
+                         sql)
+            return
+        self.db_request(sql=sql, database=database)
+
     def prerequisites(self, database=None, table=None):
         """
         Check that destination database and tables exists before proceeding to
-        archiving. Keep the result in metadata for performance purpose.
+        archiving. All the tables of a database are checked at once the first
+        time, the result is kept for the whole run.
         """
-        if database in self.metadata and table in self.metadata[database]:
-            logging.debug("Use cached prerequisites metadata")
+        if (database, table) in self.checked_tables and \
+                (not self.partition_by_month or
+                 (database, table) in self.maintained_tables):
             return
 
-        self.metadata[database] = {}
-        logging.info("Checking prerequisites")
+        with self.prerequisites_lock:
+            if database not in self.checked_databases:
+                self.check_database_prerequisites(database=database)
+                self.checked_databases.add(database)
+            # tables which were not to archive when the database was checked
+            if (database, table) not in self.checked_tables:
+                logging.info("Checking prerequisites of %s.%s", database,
+                             table)
+                self.create_archive_table(database=database, table=table)
+                self.checked_tables.add((database, table))
+            # partitions are maintained once per run
+            if self.partition_by_month and \
+                    (database, table) not in self.maintained_tables:
+                self.maintain_partitions(database=database, table=table)
+                self.maintained_tables.add((database, table))
+
+    def prerequisites_cache_key(self, database=None):
+        """
+        Return the key of the prerequisites of a database in the metadata
+        cache, the archive tables depend on the table suffix and on the
+        partitioning
+        """
+        return 'prerequisites:{host}:{port}/{db}/{suffix}/{partitioned}'\
+            .format(host=self.host,
+                    port=self.port,
+                    db=database,
+                    suffix=self.normalize_table_suffix(),
+                    partitioned=int(bool(self.partition_by_month)))
 
+    def check_database_prerequisites(self, database=None):
+        """
+        Check the archive database and the archive tables of all the tables
+        to archive of a database in one pass: the definitions (columns,
+        indexes, foreign keys and table options, what SHOW CREATE TABLE
+        shows) of the source and archive tables are compared by hash from
+        the schema snapshots, the archive tables missing are created and
+        those which differ are compared with their CREATE statement.
+        If a metadata cache is configured the checked tables and their
+        archive tables are kept in it and reused while neither the source nor
+        the archive schema changed and the archive tables still exist.
+        """
+        logging.info("Checking prerequisites of database %s", database)
         self.create_archive_db(database=database)
-        self.create_archive_table(database=database, table=table)
-        self.metadata[database][table] = \
-            {'checked': True,
-             'primary_key': self.get_table_primary_key(database=database,
-                                                       table=table)}
-        return
+        archive_db = self.archive_db_name
+        tables = self.source.tables_to_archive(database=database)
+
+        cache_key = self.prerequisites_cache_key(database=archive_db)
+        fingerprints = None
+        if self.metadata_cache is not None:
+            (archive_fingerprint,
+             archive_tables) = self.get_schema_fingerprint(database=archive_db)
+            fingerprints = {
+                'source': self.source.get_schema_fingerprint(
+                    database=database)[0],
+                'archive': archive_fingerprint
+            }
+            cached = self.metadata_cache.get(key=cache_key)
+            if cached is not None and cached['fingerprints'] == fingerprints:
+                cached_tables = [
+                    t for t in tables
+                    if cached['tables'].get(t) == self.get_archive_table_name(
+                        table=t) and cached['tables'][t] in archive_tables
+                ]
+                logging.info("Using cached prerequisites of %s tables of %s",
+                             len(cached_tables), database)
+                self.checked_tables.update([(database, t)
+                                            for t in cached_tables])
+                tables = [t for t in tables if t not in cached_tables]
+                if not tables:
+                    return
+
+        source_schema = self.source.get_schema(database=database)
+        archive_schema = Schema.load(db=self, database=archive_db)
+        created = False
+        for table in tables:
+            archive_table = self.get_archive_table_name(table=table)
+            if self.partition_by_month:
+                expected_hash = Schema.hash_definition(
+                    definition=self.partitioned_definition(
+                        definition=source_schema.definition(table=table)))
+            else:
+                expected_hash = source_schema.definition_hash(table=table)
+            if archive_table in archive_schema.tables and expected_hash == \
+                    archive_schema.definition_hash(table=archive_table):
+                logging.debug("%s.%s and %s.%s are identical", database,
+                              table, archive_db, archive_table)
+            else:
+                self.create_archive_table(database=database, table=table)
+                created = True
+            self.checked_tables.add((database, table))
+
+        if fingerprints is not None and not self.dry_run:
+            if created:
+                fingerprints['archive'] = self.get_schema_fingerprint(
+                    database=archive_db, refresh=True)[0]
+            self.metadata_cache.set(key=cache_key,
+                                    value={
+                                        'fingerprints': fingerprints,
+                                        'tables': {
+                                            t: self.get_archive_table_name(
+                                                table=t)
+                                            for (d, t) in self.checked_tables
+                                            if d == database
+                                        }
+                                    })
 
     def db_bulk_insert(self,
                        sql=None,
@@ -371,6 +832,140 @@ class Db(Destination, DbBase):
 
         return values
 
+    def insert_template(self, database=None, table=None, columns=None):
+        """
+        Return the INSERT statement of a set of columns in the archive table
+        of a table, it is built once per archive database, archive table and
+        columns, the columns being in the order of the rows of the sets of
+        data
+        """
+        archive_db = self.get_archive_db_name(database=database)
+        archive_table = self.get_archive_table_name(table=table)
+        key = (archive_db, archive_table, tuple(columns))
+        if key not in self.insert_templates:
+            # the primary key is read from the source schema, the archive
+            # table being a copy of the source table
+            primary_key = self.source.get_table_primary_key(database=database,
+                                                            table=table)
+            self.insert_templates[key] = "INSERT INTO `{database}`."\
+                "`{table}` ({columns}) VALUES ({placeholders}) ON DUPLICATE "\
+                "KEY UPDATE `{pk}` = `{pk}`".format(
+                    database=archive_db,
+                    table=archive_table,
+                    columns=', '.join(['`{c}`'.format(c=c) for c in columns]),
+                    placeholders=', '.join(['%s'] * len(columns)),
+                    pk=primary_key)
+            logging.debug("INSERT statement of %s.%s: %s", archive_db,
+                          archive_table, self.insert_templates[key])
+        return self.insert_templates[key]
+
+    @staticmethod
+    def tsv_value(value=None):
+        """
+        Return a value as bytes in the default format of LOAD DATA: NULL is
+        \\N, backslash, tab, new line, carriage return and NUL are escaped
+        """
+        if value is None:
+            return b'\\N'
+        if isinstance(value, datetime.timedelta):
+            # TIME columns, which may exceed 24 hours
+            seconds = int(value.total_seconds())
+            sign = '-' if seconds < 0 else ''
+            seconds = abs(seconds)
+            value = '{sign}{h}:{m:02d}:{s:02d}'.format(sign=sign,
+                                                       h=seconds // 3600,
+                                                       m=seconds // 60 % 60,
+                                                       s=seconds % 60)
+        if isinstance(value, (bytes, bytearray)):
+            raw = bytes(value)
+        else:
+            raw = str(value).encode('utf-8')
+        return raw.replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(
+            b'\n', b'\\n').replace(b'\r', b'\\r').replace(b'\0', b'\\0')
+
+    def db_load_data(self, database=None, table=None, columns=None,
+                     values=None):
+        """
+        Write a set of rows in a temporary TSV file and load it with
+            LOAD DATA LOCAL INFILE '<file>' IGNORE|REPLACE INTO TABLE ...
+        """
+        with tempfile.NamedTemporaryFile(mode='wb',
+                                         prefix='osarchiver-',
+                                         suffix='.tsv',
+                                         delete=False) as tsv_file:
+            for row in values:
+                tsv_file.write(b'\t'.join([self.tsv_value(v) for v in row]) +
+                               b'\n')
+        sql = "LOAD DATA LOCAL INFILE {file} {duplicates} INTO TABLE "\
+            "`{database}`.`{table}` CHARACTER SET utf8mb4 FIELDS TERMINATED "\
+            "BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "\
+            "({columns})".format(
+                file=self.connection.escape(tsv_file.name),
+                duplicates=self.load_data_duplicates.upper(),
+                database=database,
+                table=table,
+                columns=', '.join(['`{c}`'.format(c=c) for c in columns]))
+        try:
+            self.load_data_rows = len(values)
+            count = self.db_request(sql=sql,
+                                    database=database,
+                                    table=table,
+                                    foreign_key_check=False)
+            logging.info("%s rows loaded into %s.%s", count, database, table)
+        finally:
+            self.load_data_rows = None
+            os.remove(tsv_file.name)
+
+    def _db_commit(self, cursor=None, sql=None, values_length=None):
+        """
+        Commit the executed request, a LOAD DATA is checked first
+        """
+        if self.load_data_rows is not None:
+            self.check_load_data(cursor=cursor, rows=self.load_data_rows)
+        return DbBase._db_commit(self,
+                                 cursor=cursor,
+                                 sql=sql,
+                                 values_length=values_length)
+
+    def check_load_data(self, cursor=None, rows=None):
+        """
+        Raise OSArchiverLoadDataFailed if a LOAD DATA did not store all the
+        rows sent: LOAD DATA LOCAL turns the conversion and truncation errors
+        into warnings and skips the invalid rows. The duplicates are the only
+        rows allowed to be skipped (ignore), each one with its warning, or
+        counted twice (replace). The server keeps max_error_count warnings
+        only, the check fails if some of them could not be read
+        """
+        count = cursor.rowcount
+        warnings = list(self.connection.show_warnings() or [])
+        # another cursor, the one of the LOAD DATA gives the rows affected
+        with self.connection.cursor() as warning_cursor:
+            warning_cursor.execute("SELECT @@warning_count")
+            warning_count = int(warning_cursor.fetchone()[0])
+        if warning_count > len(warnings):
+            raise db_errors.OSArchiverLoadDataFailed(
+                message='{count} warnings, {fetched} only could be '
+                'checked'.format(count=warning_count, fetched=len(warnings)))
+        duplicates = len(
+            [w for w in warnings if int(w[1]) == DUPLICATE_ENTRY_ERROR])
+        errors = [w for w in warnings if int(w[1]) != DUPLICATE_ENTRY_ERROR]
+        if errors:
+            for warning in errors[:10]:
+                logging.error("LOAD DATA warning: %s", warning)
+            raise db_errors.OSArchiverLoadDataFailed(
+                message='{} warnings'.format(len(errors)))
+        if self.load_data_duplicates == 'ignore':
+            valid = count == rows - duplicates
+        else:
+            # a replaced row is deleted then inserted
+            valid = rows <= count <= 2 * rows
+        if not valid:
+            raise db_errors.OSArchiverLoadDataFailed(
+                message='{count} rows affected for {rows} rows sent and '
+                '{duplicates} duplicates'.format(count=count,
+                                                 rows=rows,
+                                                 duplicates=duplicates))
+
     def write(self, database=None, table=None, data=None):
         """
         Write method implemented which is in charge of writing data from
@@ -384,39 +979,142 @@ class Db(Destination, DbBase):
             return
 
         self.prerequisites(database=database, table=table)
-        primary_key = self.get_table_primary_key(database=database,
-                                                 table=table)
-
-        values = []
-        for item in data:
-            placeholders = ', '.join(['%s'] * len(item))
-            columns = '`' + '`, `'.join(item.keys()) + '`'
-            sql = "INSERT INTO {database}.{table} ({columns}) VALUES "\
-                "({placeholders}) ON DUPLICATE KEY UPDATE {pk} = {pk}".format(
-                    database=self.archive_db_name,
+        if not self.needs_rows():
+            self.write_server_side(database=database, table=table, data=data)
+            return
+
+        archive_db = self.get_archive_db_name(database=database)
+        archive_table = self.get_archive_table_name(table=table)
+        sql = self.insert_template(database=database,
+                                   table=table,
+                                   columns=data.columns)
+
+        # rows of the Batch are already tuples of values, insert them by
+        # set of bulk_insert rows, with the writer of the table if a pool of
+        # writers is configured
+        futures = []
+        start = 0
+        while start < len(data):
+            bulk_insert = self.get_limit(database=archive_db,
+                                         table=archive_table,
+                                         name='bulk_insert')
+            values = data.rows[start:start + bulk_insert]
+            start += len(values)
+            if self.writer_pool is None:
+                self.write_values(sql=sql,
+                                  database=archive_db,
+                                  table=archive_table,
+                                  columns=data.columns,
+                                  values=values)
+            else:
+                futures.append(
+                    self.writer_pool.submit(sql=sql,
+                                            database=archive_db,
+                                            table=archive_table,
+                                            columns=data.columns,
+                                            values=values))
+        # the set of data is archived once all its writes are acknowledged,
+        # an error of a writer is raised here
+        for future in futures:
+            future.result()
+        return
+
+    def write_values(self,
+                     sql=None,
+                     database=None,
+                     table=None,
+                     columns=None,
+                     values=None):
+        """
+        Write a set of rows in an archive table with the bulk_loader and
+        adapt the bulk_insert limit of the table
+        """
+        if self.bulk_loader == 'load_data':
+            self.db_load_data(database=database,
+                              table=table,
+                              columns=columns,
+                              values=values)
+        else:
+            self.db_bulk_insert(sql=sql,
+                                database=database,
+                                table=table,
+                                values=values,
+                                force_commit=True)
+        self.update_limit(database=database,
+                          table=table,
+                          name='bulk_insert',
+                          duration=self.last_execute_duration +
+                          self.last_commit_duration,
+                          rows=len(values))
+
+    def write_server_side(self, database=None, table=None, data=None):
+        """
+        Archive a set of data without transferring the rows, they are copied
+        by the server from the source table:
+            INSERT INTO <archive db>.<table> (<columns>) SELECT <columns>
+            FROM <db>.<table> WHERE <keys> ON DUPLICATE KEY UPDATE ...
+        The keys are matched by set of bulk_insert keys, the contiguous
+        integer keys being coalesced into ranges
+        """
+        schema = self.source.get_schema(database=database)
+        primary_keys = schema.primary_keys(table=table)
+        columns = ', '.join(
+            ['`{c}`'.format(c=c) for c in schema.column_names(table=table)])
+        keys = data.keys(columns=primary_keys)
+        archive_db = self.get_archive_db_name(database=database)
+        archive_table = self.get_archive_table_name(table=table)
+
+        start = 0
+        while start < len(keys):
+            bulk_insert = self.get_limit(database=archive_db,
+                                         table=archive_table,
+                                         name='bulk_insert')
+            subkeys = keys[start:start + bulk_insert]
+            start += len(subkeys)
+            if len(primary_keys) > 1:
+                keys_condition = self.source.sql_keys_in(columns=primary_keys,
+                                                         values=subkeys)
+            elif schema.primary_key_is_integer(table=table):
+                keys_condition = self.source.sql_key_ranges(
+                    primary_key=primary_keys[0], keys=subkeys)
+            else:
+                keys_condition = "`{pk}` IN ({keys})".format(
+                    pk=primary_keys[0],
+                    keys=', '.join(
+                        [self.connection.escape(k) for k in subkeys]))
+
+            sql = "INSERT INTO `{archive_db}`.`{archive_table}` ({columns}) "\
+                "SELECT {columns} FROM `{database}`.`{table}` WHERE "\
+                "{keys_condition} ON DUPLICATE KEY UPDATE "\
+                "`{archive_db}`.`{archive_table}`.`{pk}` = "\
+                "`{archive_db}`.`{archive_table}`.`{pk}`".format(
+                    archive_db=archive_db,
+                    archive_table=archive_table,
                     table=table,
                     columns=columns,
-                    placeholders=placeholders,
-                    pk=primary_key)
-            values.append([v for v in item.values()])
-            values = self.db_bulk_insert(sql=sql,
-                                         values=values,
-                                         database=self.archive_db_name,
-                                         table=table)
-
-        # Force commit of remaining data even if we do not reach the
-        # bulk_insert limit
-        self.db_bulk_insert(sql=sql,
-                            database=self.archive_db_name,
-                            table=table,
-                            values=values,
-                            force_commit=True)
-        return
+                    database=database,
+                    keys_condition=keys_condition,
+                    pk=primary_keys[0])
+            count = self.db_request(sql=sql,
+                                    database=archive_db,
+                                    table=archive_table,
+                                    foreign_key_check=False)
+            logging.info("%s rows copied into %s.%s", count, archive_db,
+                         archive_table)
+            self.update_limit(database=archive_db,
+                              table=archive_table,
+                              name='bulk_insert',
+                              duration=self.last_execute_duration +
+                              self.last_commit_duration,
+                              rows=len(subkeys))
 
     def clean_exit(self):
         """
         Tasks to be executed to exit cleanly
         - disconnect from the db
         """
+        if self.writer_pool is not None and not self.cloned:
+            logging.info("Closing destination writers")
+            self.writer_pool.close()
         logging.info("Closing destination DB connection")
         self.disconnect()
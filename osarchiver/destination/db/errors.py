@@ -28,3 +28,14 @@ class OSArchiverNotEqualTableCreateStatements(OSArchiverException):
     def __init__(self, message=None):
         super().__init__(message='The SHOW CREATE TABLE statement is not equal'
                          ' between src and dst table')
+
+
+class OSArchiverLoadDataFailed(OSArchiverException):
+    """
+    Exception raised when a LOAD DATA did not store all the rows sent or
+    raised warnings (truncated or converted values)
+    """
+
+    def __init__(self, message=None):
+        super().__init__(message='LOAD DATA of the set of data failed: '
+                         '{}'.format(message))
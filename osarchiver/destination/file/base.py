@@ -5,16 +5,62 @@
 Base class file of file backend implementation.
 """
 
+import bz2
+import collections
+import gzip
+import io
 import logging
+import lzma
 import os
+import pickle
 import shutil
 import re
+import tarfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from importlib import import_module
 from abc import ABCMeta, abstractmethod
 import arrow
+from osarchiver.common.batch import Batch
 from osarchiver.destination.base import Destination
 from osarchiver.destination.file.remote_store import factory as remote_store_factory
 
+# streaming compressions of the formatters and extension of their files
+COMPRESSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+# extensions of the files which are not archived at exit: compressed streams
+# and formats compressed by themselves
+COMPRESSED_EXTENSIONS = tuple(COMPRESSIONS.values()) + ('.parquet', )
+
+# extension of the files in which the sets of data not yet durable in the
+# compressed streams and Parquet files are kept, they are not archived
+SPOOL_EXTENSION = '.spool'
+
+# archive formats which can be compressed by chunks in parallel, the
+# compressed chunks being concatenated in a multi-stream file
+MULTI_STREAM_FORMATS = {
+    'gztar': ('.tar.gz', gzip),
+    'bztar': ('.tar.bz2', bz2),
+    'xztar': ('.tar.xz', lzma)
+}
+
+
+def compress_chunk(path=None,
+                   offset=0,
+                   length=0,
+                   prefix=b'',
+                   suffix=b'',
+                   archive_format=None):
+    """
+    Return a chunk of a file, surrounded by a prefix and a suffix, compressed
+    as one stream of an archive format, run in the compression processes
+    """
+    with open(path, 'rb') as file_to_compress:
+        file_to_compress.seek(offset)
+        data = file_to_compress.read(length)
+    return MULTI_STREAM_FORMATS[archive_format][1].compress(prefix + data +
+                                                            suffix)
+
 
 class File(Destination):
     """
@@ -29,6 +75,10 @@ class File(Destination):
                  dry_run=False,
                  source=None,
                  remote_store=None,
+                 compression=None,
+                 compress_workers=1,
+                 compress_chunk_size=67108864,
+                 spool_size=67108864,
                  **kwargs):
         """
         Initiator
@@ -41,6 +91,16 @@ class File(Destination):
         is called a formatter
         :param bool dry_run: if enable  will not write for real
         :param source: the Source instance
+        :param str compression: the compression of the streams written by the
+        formatters (gzip, bz2, xz or zstd), the files are then not archived at
+        exit
+        :param int compress_workers: the number of processes archiving the
+        files at exit
+        :param int compress_chunk_size: the size in bytes of the chunks of a
+        file compressed in parallel
+        :param int spool_size: the size in bytes of the sets of data spooled
+        before the compressed streams are ended and the Parquet files closed,
+        when the sets of data are flushed
         """
 
         # Archive formats: zip, tar, gztar, bztar, xztar
@@ -51,20 +111,49 @@ class File(Destination):
         self.archive_format = archive_format
         self.formats = re.split(r'\n|,|;', formats)
         self.formatters = {}
+        if compression in [None, '', 'none']:
+            compression = None
+        elif compression not in COMPRESSIONS:
+            raise ValueError(
+                "Unsupported compression '{}'".format(compression))
+        self.compression = compression
+        self.compress_workers = int(compress_workers)
+        self.compress_chunk_size = int(compress_chunk_size)
+        self.spool_size = int(spool_size)
+        # file in which the flushed sets of data are kept until the
+        # compressed streams and Parquet files are durable
+        self.spool = None
+        # spool files and their durable size, None once not needed anymore
+        self.spools = {}
+        # files left by an interrupted run and their durable size
+        self.adopted_files = {}
         self.source = source
         self.dry_run = dry_run
         self.remote_store = None
         if remote_store is not None:
             self.remote_store = re.split(r'\n|,|;', remote_store)
+        # formatters are shared by all the workers of an archiver
+        self.lock = threading.Lock()
 
         self.init()
 
+    def clone(self, source=None):
+        """
+        Files are written locally without any connection, the same instance is
+        shared by the workers of an archiver, the writes being serialized
+        """
+        return self
+
     def close(self):
         """
-        This method close will call close() method of each formatter
+        This method close will call close() method of each formatter, the
+        files are then durable and the spool is not needed anymore
         """
         for formatter in self.formatters:
             getattr(self.formatters[formatter], 'close')()
+        if not self.dry_run:
+            with self.lock:
+                self.rollover()
 
     def clean_exit(self):
         """
@@ -82,7 +171,8 @@ class File(Destination):
                 store_options = self.conf.section(
                     'remote_store:%s' % store, default=False)
                 remote_store = remote_store_factory(
-                    name=store, date=self.date, store_options=store_options)
+                    name=store, date=self.date, store_options=store_options,
+                    directory=self.directory)
                 if self.dry_run:
                     logging.info(
                         "As we are in dry-run mode we do not send on %s store", store)
@@ -102,20 +192,189 @@ class File(Destination):
 
     def files(self):
         """
-        Return a list of files open by all formatters
+        Return a list of files open by all formatters and of the files adopted
+        from an interrupted run. The formatters may be written by other
+        workers meanwhile, the list is built under the lock
+        """
+        with self.lock:
+            files = []
+            for formatter in self.formatters:
+                files.extend(getattr(self.formatters[formatter], 'files')())
+
+            files.extend([
+                f for f in sorted(self.adopted_files)
+                if f not in files and os.path.exists(f)
+            ])
+            return files
+
+    def file_sizes(self):
+        """
+        Return a dict of the files written, adopted and spooled, and of their
+        size durable on the disk, None if nothing in the file is
+        """
+        with self.lock:
+            sizes = dict(self.adopted_files)
+            for formatter in self.formatters:
+                sizes.update(self.formatters[formatter].file_sizes())
+            sizes.update(self.spools)
+            return sizes
+
+    def flush(self, database=None, table=None, data=None):
+        """
+        Make a set of data written durable: the plain files of the formatters
+        are synced to the disk. The compressed streams and the Parquet files
+        can't be synced without ending them, the set of data is appended to
+        the spool which is synced instead. Once spool_size bytes are spooled
+        the streams are ended and the Parquet files closed, a new spool is
+        started
+        """
+        with self.lock:
+            for formatter in self.formatters:
+                self.formatters[formatter].flush()
+            if self.dry_run or not data or all(
+                    [f.flushable() for f in self.formatters.values()]):
+                return
+            self.spool_set(database=database, table=table, data=data)
+            if self.spools[self.spool.name] >= self.spool_size:
+                self.rollover()
+
+    def spool_set(self, database=None, table=None, data=None):
+        """
+        Append a set of data to the spool and sync it, the caller must hold
+        the lock
+        """
+        if self.spool is None:
+            number = 0
+            while True:
+                path = os.path.join(
+                    self.directory,
+                    '.osarchiver-{n:06d}{ext}'.format(n=number,
+                                                      ext=SPOOL_EXTENSION))
+                if not os.path.exists(path) and path not in self.spools:
+                    break
+                number += 1
+            logging.debug("Spooling the sets of data in %s", path)
+            self.spool = open(path, 'wb')
+        pickle.dump((database, table, data.columns, list(data.rows)),
+                    self.spool,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+        self.spool.flush()
+        os.fsync(self.spool.fileno())
+        self.spools[self.spool.name] = self.spool.tell()
+
+    def rollover(self):
+        """
+        Make all the files of the formatters durable: the compressed streams
+        are ended and the Parquet files closed. The current spool is not
+        needed anymore once the new sizes are saved in a checkpoint, the
+        caller must hold the lock
         """
-        files = []
         for formatter in self.formatters:
-            files.extend(getattr(self.formatters[formatter], 'files')())
+            self.formatters[formatter].rollover()
+        if self.spool is not None:
+            self.spool.close()
+            self.spools[self.spool.name] = None
+            self.spool = None
+
+    def checkpointed(self, files=None):
+        """
+        Remove the spools which are not needed anymore in the files saved in
+        a checkpoint
+        """
+        with self.lock:
+            for path in [
+                    p for (p, size) in self.spools.items()
+                    if size is None and p in files and files[p] is None
+            ]:
+                if os.path.exists(path):
+                    os.remove(path)
+                del self.spools[path]
+
+    def adopt_files(self, files=None):
+        """
+        Take over the files of an interrupted run which are still in place,
+        they are compressed and sent with the files of the current run. A
+        file is truncated to its size durable on the disk, a compressed
+        stream then ends with a complete stream, and a file with nothing
+        durable is removed: the rows after the durable size were not deleted
+        or are in a spool. The sets of data of the spools are written again
+        in the files of the current run
+        """
+        files = files or {}
+        spools = []
+        for adopted_file in sorted(files):
+            if adopted_file in self.adopted_files or \
+                    adopted_file in self.spools or \
+                    not os.path.exists(adopted_file):
+                continue
+            size = files[adopted_file]
+            if adopted_file.endswith(SPOOL_EXTENSION):
+                if size:
+                    spools.append(adopted_file)
+                else:
+                    os.remove(adopted_file)
+                continue
+            if not size:
+                logging.info("Removing %s left by an interrupted run, none "
+                             "of its rows is durable", adopted_file)
+                os.remove(adopted_file)
+                continue
+            if os.path.getsize(adopted_file) > size:
+                logging.info("Truncating %s left by an interrupted run to "
+                             "its %s durable bytes", adopted_file, size)
+                with open(adopted_file, 'r+b') as truncated_file:
+                    truncated_file.truncate(size)
+            logging.info("Adopting %s left by an interrupted run",
+                         adopted_file)
+            self.adopted_files[adopted_file] = size
+        for spool in spools:
+            self.replay(path=spool, size=files[spool])
 
-        return files
+    def replay(self, path=None, size=None):
+        """
+        Write again the sets of data of a spool left by an interrupted run,
+        up to its durable size, in the formatters which can't be flushed. They
+        are spooled again, the spool is removed once checkpointed
+        """
+        logging.info("Writing again the sets of data spooled in %s", path)
+        with open(path, 'rb') as spool_file:
+            spooled = io.BytesIO(spool_file.read(size))
+        while spooled.tell() < size:
+            (database, table, columns, rows) = pickle.load(spooled)
+            data = Batch(columns=columns, rows=rows)
+            with self.lock:
+                self._write(database=database,
+                            table=table,
+                            data=data,
+                            replay=True)
+            self.flush(database=database, table=table, data=data)
+        self.spools[path] = None
 
     def compress(self):
         """
         Compress all the files open by formatters
         """
         compressed_files = []
+        files_to_compress = []
         for file_to_compress in self.files():
+            if file_to_compress.endswith(COMPRESSED_EXTENSIONS):
+                # already compressed by the formatter
+                if self.dry_run:
+                    os.remove(file_to_compress)
+                    continue
+                logging.info("Compressed file available at %s",
+                             file_to_compress)
+                compressed_files.append(file_to_compress)
+            else:
+                files_to_compress.append(file_to_compress)
+
+        if self.compress_workers > 1 and files_to_compress and \
+                not self.dry_run:
+            compressed_files.extend(
+                self.compress_in_parallel(files=files_to_compress))
+            return compressed_files
+
+        for file_to_compress in files_to_compress:
             logging.info("Archiving %s using %s format", file_to_compress,
                          self.archive_format)
             compressed_file = shutil.make_archive(
@@ -132,6 +391,106 @@ class File(Destination):
                 os.remove(file_to_compress)
         return compressed_files
 
+    def compress_in_parallel(self, files=None):
+        """
+        Compress files with a pool of compress_workers processes. The files of
+        the gztar, bztar and xztar formats are compressed by chunks of
+        compress_chunk_size bytes, the other formats one file per process
+        """
+        logging.info("Archiving %s files using %s format with %s processes",
+                     len(files), self.archive_format, self.compress_workers)
+        with ProcessPoolExecutor(max_workers=self.compress_workers) as \
+                executor:
+            if self.archive_format in MULTI_STREAM_FORMATS:
+                archives = self.compress_chunks(executor=executor, files=files)
+            else:
+                futures = [(f,
+                            executor.submit(shutil.make_archive,
+                                            f,
+                                            self.archive_format,
+                                            root_dir=os.path.dirname(f),
+                                            base_dir=os.path.basename(f)))
+                           for f in files]
+                archives = [(f, future.result()) for (f, future) in futures]
+
+        compressed_files = []
+        for (file_to_compress, compressed_file) in archives:
+            logging.info("Compressed file available at %s", compressed_file)
+            compressed_files.append(compressed_file)
+            os.remove(file_to_compress)
+        return compressed_files
+
+    @staticmethod
+    def tar_framing(path=None):
+        """
+        Return the header of a file in a tar archive and the end of the
+        archive (padding of the file and end of archive blocks)
+        """
+        stat = os.stat(path)
+        info = tarfile.TarInfo(name=os.path.basename(path))
+        info.size = stat.st_size
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o7777
+        header = info.tobuf(format=tarfile.DEFAULT_FORMAT,
+                            encoding='utf-8',
+                            errors='surrogateescape')
+        tail = tarfile.NUL * ((-info.size) % tarfile.BLOCKSIZE) + \
+            tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+        length = len(header) + info.size + len(tail)
+        tail += tarfile.NUL * ((-length) % tarfile.RECORDSIZE)
+        return (header, tail)
+
+    def compress_chunks(self, executor=None, files=None):
+        """
+        Write the tar archive of each file, compressed by chunks in the
+        processes of the executor. The compressed chunks are written in order
+        in the archive, a valid multi-stream file like pigz or pbzip2 ones.
+        Return the list of (file, archive)
+        """
+        (extension, _) = MULTI_STREAM_FORMATS[self.archive_format]
+        archives = []
+        outputs = {}
+        pending = collections.deque()
+        try:
+            for file_to_compress in files:
+                compressed_file = file_to_compress + extension
+                archives.append((file_to_compress, compressed_file))
+                outputs[compressed_file] = open(compressed_file, 'wb')
+                (header, tail) = self.tar_framing(path=file_to_compress)
+                size = os.path.getsize(file_to_compress)
+                offsets = list(range(0, size, self.compress_chunk_size)) or [0]
+                for (index, offset) in enumerate(offsets):
+                    last = index == len(offsets) - 1
+                    future = executor.submit(
+                        compress_chunk,
+                        path=file_to_compress,
+                        offset=offset,
+                        length=min(self.compress_chunk_size, size - offset),
+                        prefix=header if index == 0 else b'',
+                        suffix=tail if last else b'',
+                        archive_format=self.archive_format)
+                    pending.append((compressed_file, future, last))
+                    # a bounded number of chunks in memory
+                    while len(pending) > 2 * self.compress_workers:
+                        self.write_chunk(outputs=outputs,
+                                         chunk=pending.popleft())
+            while pending:
+                self.write_chunk(outputs=outputs, chunk=pending.popleft())
+        finally:
+            for output in outputs.values():
+                output.close()
+        return archives
+
+    @staticmethod
+    def write_chunk(outputs=None, chunk=None):
+        """
+        Write a compressed chunk in its archive, closed after its last chunk
+        """
+        (compressed_file, future, last) = chunk
+        outputs[compressed_file].write(future.result())
+        if last:
+            outputs.pop(compressed_file).close()
+
     def init(self):
         """
         init stuff
@@ -151,6 +510,15 @@ class File(Destination):
         logging.info("Writing on backend %s %s data length", self.backend,
                      len(data))
 
+        with self.lock:
+            self._write(database=database, table=table, data=data)
+
+    def _write(self, database=None, table=None, data=None, replay=False):
+        """
+        Write the data set in each format, the caller must hold the lock. A
+        spooled data set is replayed in the formats which can't be flushed
+        only
+        """
         for write_format in self.formats:
             # initiate formatter
             if write_format not in self.formatters:
@@ -163,7 +531,8 @@ class File(Destination):
                     formatter_instance = formatter_class(
                         directory=self.directory,
                         dry_run=self.dry_run,
-                        source=self.source)
+                        source=self.source,
+                        compression=self.compression)
                     self.formatters[write_format] = formatter_instance
                 except (AttributeError, ImportError) as my_exception:
                     logging.error(my_exception)
@@ -177,6 +546,8 @@ class File(Destination):
                                 write_format))
 
             writer = self.formatters[write_format]
+            if replay and writer.flushable():
+                continue
             writer.write(database=database, table=table, data=data)
 
 
@@ -186,7 +557,12 @@ class Formatter(metaclass=ABCMeta):
     inherit from that class
     """
 
-    def __init__(self, name=None, directory=None, dry_run=None, source=None):
+    def __init__(self,
+                 name=None,
+                 directory=None,
+                 dry_run=None,
+                 source=None,
+                 compression=None):
         """
         Initiator:
 
@@ -197,6 +573,123 @@ class Formatter(metaclass=ABCMeta):
         self.now = arrow.now().strftime('%F_%T')
         self.dry_run = dry_run
         self.name = name or type(self).__name__.upper()
+        self.compression = compression
+
+    def open_file(self, path=None):
+        """
+        Open a file to write text, through a compressed stream if a
+        compression is configured. Return the path of the file, with the
+        extension of the compression, and the file handler.
+        A file which already exists, left by an interrupted run, is never
+        truncated: a plain file is appended, a compressed stream can not be
+        so it is written under another name
+        """
+        if self.compression is None:
+            if os.path.exists(path):
+                logging.info("Appending to %s which already exists", path)
+            return (path, open(path, 'a', encoding='utf-8'))
+        path = self.available_path(path=path,
+                                   extension=COMPRESSIONS[self.compression])
+        logging.debug("Opening %s compressed stream %s", self.compression,
+                      path)
+        return (path, self.open_stream(path=path, mode='wt'))
+
+    def open_stream(self, path=None, mode='wt'):
+        """
+        Open a compressed stream to write text in a file, a new stream is
+        appended to the file in 'at' mode
+        """
+        if self.compression == 'gzip':
+            return gzip.open(path, mode, encoding='utf-8')
+        if self.compression == 'bz2':
+            return bz2.open(path, mode, encoding='utf-8')
+        if self.compression == 'xz':
+            return lzma.open(path, mode, encoding='utf-8')
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard "
+                              "module")
+        return zstandard.open(path, mode, encoding='utf-8')
+
+    @staticmethod
+    def available_path(path=None, extension=''):
+        """
+        Return the path of a file with an extension, numbered before its
+        format extension if it already exists:
+        <db>.<table>.csv.gz, <db>.<table>.1.csv.gz, ...
+        """
+        available = path + extension
+        (root, format_extension) = os.path.splitext(path)
+        number = 0
+        while os.path.exists(available):
+            number += 1
+            available = '{root}.{number}{format}{extension}'.format(
+                root=root,
+                number=number,
+                format=format_extension,
+                extension=extension)
+        if number:
+            logging.info("%s already exists, writing %s", path + extension,
+                         available)
+        return available
+
+    def flushable(self):
+        """
+        Return True if the rows written can be made durable without ending
+        the files, which is the case of the plain files only
+        """
+        return self.compression is None
+
+    @staticmethod
+    def sync(path=None):
+        """
+        Sync a file to the disk and return its size
+        """
+        try:
+            with open(path, 'rb') as file_to_sync:
+                os.fsync(file_to_sync.fileno())
+        except OSError as fsync_exception:
+            logging.warning("Unable to sync %s to the disk: %s", path,
+                            fsync_exception)
+        return os.path.getsize(path)
+
+    def flush(self):
+        """
+        Write the buffered rows of the plain files to the disk, the other
+        files are made durable by rollover only
+        """
+        if not self.flushable():
+            return
+        for handler in self.handlers.values():
+            if not handler['fh'].closed:
+                handler['fh'].flush()
+            handler['size'] = self.sync(path=handler['file'])
+
+    def rollover(self):
+        """
+        Make all the rows written durable: a compressed stream is ended and
+        the file is reopened to append a new stream, so that the file is
+        valid up to the last row
+        """
+        if self.flushable():
+            self.flush()
+            return
+        for handler in self.handlers.values():
+            if handler['fh'].closed:
+                handler['size'] = self.sync(path=handler['file'])
+                continue
+            handler['fh'].close()
+            # the size is read before the header of the next stream is written
+            handler['size'] = self.sync(path=handler['file'])
+            handler['fh'] = self.open_stream(path=handler['file'], mode='at')
+
+    def file_sizes(self):
+        """
+        Return a dict of the files and of their durable size, None if
+        nothing is durable yet
+        """
+        return {h['file']: h.get('size') for h in self.handlers.values()}
 
     def files(self):
         """
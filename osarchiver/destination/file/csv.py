@@ -13,15 +13,16 @@ from osarchiver.destination.file.base import Formatter
 
 class Csv(Formatter):
     """
-    The class implement a formatter of CSV type which is able to convert a list
-    of dict of SQL data into one CSV file
+    The class implement a formatter of CSV type which is able to convert a
+    Batch of SQL data into one CSV file
     """
 
     def write(self, database=None, table=None, data=None):
         """
         The write method which should be implemented because of ineherited
         Formatter class.
-        The name of the file is of the form <database>.<table>.csv
+        The name of the file is of the form <database>.<table>.csv, followed
+        by the extension of the compression if any
         """
 
         destination_file = '{directory}/{db}.{table}.csv'.format(
@@ -29,30 +30,32 @@ class Csv(Formatter):
         )
         key = '{db}.{table}'.format(db=database, table=table)
 
-        writer = None
+        # the writer is bound to the current file handler, which is reopened
+        # when a compressed stream is flushed
         if key in self.handlers:
-            writer = self.handlers[key]['csv_writer']
+            destination_file = self.handlers[key]['file']
+            writer = csv.writer(self.handlers[key]['fh'])
         else:
             self.handlers[key] = {}
+            (destination_file, self.handlers[key]['fh']) = self.open_file(
+                path=destination_file)
             self.handlers[key]['file'] = destination_file
-            self.handlers[key]['fh'] = open(
-                destination_file, 'w', encoding='utf-8')
-            self.handlers[key]['csv_writer'] = \
-                csv.DictWriter(
-                    self.handlers[key]['fh'],
-                    fieldnames=[h for h in data[0].keys()])
-            writer = self.handlers[key]['csv_writer']
-            if not self.dry_run:
-                logging.debug("It seems this is the first write set, adding "
-                              " headers to CSV file")
-                writer.writeheader()
-            else:
+            writer = csv.writer(self.handlers[key]['fh'])
+            if self.dry_run:
                 logging.debug(
                     "[DRY RUN] headers not written in %s", destination_file)
+            elif self.compression is None and \
+                    self.handlers[key]['fh'].tell() > 0:
+                logging.debug("Appending to %s, headers already written",
+                              destination_file)
+            else:
+                logging.debug("It seems this is the first write set, adding "
+                              " headers to CSV file")
+                writer.writerow(data.columns)
 
         logging.info("%s formatter: writing %s line in %s", self.name,
                      len(data), destination_file)
         if not self.dry_run:
-            writer.writerows(data)
+            writer.writerows(data.rows)
         else:
             logging.debug("[DRY RUN] No data written in %s", destination_file)
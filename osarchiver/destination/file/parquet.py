@@ -0,0 +1,206 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+
+"""
+Implementation of Parquet writer (SQL data -> Apache Parquet files)
+
+The files are laid out as <database>/<table>/date=<run>/part-<N>.parquet so
+that analytics tools can prune them, the column types are mapped from the
+schema of the source table. It requires the pyarrow module.
+"""
+
+import datetime
+import logging
+import os
+import re
+from osarchiver.destination.file.base import Formatter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# number of rows of a part file before a new one is started
+ROWS_PER_PART = 1000000
+
+# column compressions of the Parquet format among the stream compressions
+PARQUET_COMPRESSIONS = ['gzip', 'zstd']
+
+
+class Parquet(Formatter):
+    """
+    The class implement a formatter of Parquet type which is able to convert
+    Batches of SQL data into Parquet files, one row group per Batch
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initiator, check that pyarrow is available
+        """
+        if pyarrow is None:
+            raise ImportError("parquet format requires the pyarrow module")
+        Formatter.__init__(self, **kwargs)
+        # current part of each table: (path, writer, number of rows)
+        self.parts = {}
+        # number of parts of each table
+        self.part_counts = {}
+
+    @staticmethod
+    def arrow_type(column=None):
+        """
+        Return the Arrow type of a column of the source schema, string if
+        the type is not known
+        """
+        if column is None:
+            return pyarrow.string()
+        data_type = column['data_type']
+        unsigned = 'unsigned' in column['column_type']
+        integers = {
+            'tinyint': (pyarrow.int8(), pyarrow.uint8()),
+            'smallint': (pyarrow.int16(), pyarrow.uint16()),
+            'mediumint': (pyarrow.int32(), pyarrow.uint32()),
+            'int': (pyarrow.int32(), pyarrow.uint32()),
+            'bigint': (pyarrow.int64(), pyarrow.uint64())
+        }
+        if data_type in integers:
+            return integers[data_type][1 if unsigned else 0]
+        if data_type == 'decimal':
+            match = re.search(r'\((\d+),(\d+)\)', column['column_type'])
+            if match and int(match.group(1)) <= 38:
+                return pyarrow.decimal128(int(match.group(1)),
+                                          int(match.group(2)))
+            return pyarrow.string()
+        types = {
+            'float': pyarrow.float32(),
+            'double': pyarrow.float64(),
+            'year': pyarrow.int16(),
+            'date': pyarrow.date32(),
+            'datetime': pyarrow.timestamp('us'),
+            'timestamp': pyarrow.timestamp('us'),
+            'time': pyarrow.duration('us'),
+            'binary': pyarrow.binary(),
+            'varbinary': pyarrow.binary(),
+            'tinyblob': pyarrow.binary(),
+            'blob': pyarrow.binary(),
+            'mediumblob': pyarrow.binary(),
+            'longblob': pyarrow.binary(),
+            'bit': pyarrow.binary()
+        }
+        return types.get(data_type, pyarrow.string())
+
+    def arrow_schema(self, database=None, table=None, columns=None):
+        """
+        Return the Arrow schema of a set of columns of a table
+        """
+        schema = self.source.get_schema(database=database)
+        return pyarrow.schema([
+            pyarrow.field(c,
+                          self.arrow_type(
+                              column=schema.column(table=table, column=c)))
+            for c in columns
+        ])
+
+    @staticmethod
+    def column_values(values=None, arrow_type=None):
+        """
+        Return the values of a column converted to its Arrow type, the
+        invalid dates (0000-00-00) returned as strings by the driver are
+        written as null
+        """
+        if pyarrow.types.is_string(arrow_type):
+            return [str(v) if v is not None else None for v in values]
+        if pyarrow.types.is_date(arrow_type) or \
+                pyarrow.types.is_timestamp(arrow_type):
+            return [
+                v if isinstance(v, (datetime.date, datetime.datetime)) else
+                None for v in values
+            ]
+        return values
+
+    def part(self, database=None, table=None, columns=None):
+        """
+        Return the current part of a table, a new one is started when there
+        is none or it has ROWS_PER_PART rows
+        """
+        key = '{db}.{table}'.format(db=database, table=table)
+        if key in self.parts and self.parts[key][2] < ROWS_PER_PART:
+            return self.parts[key]
+        if key in self.parts:
+            self.parts[key][1].close()
+
+        directory = os.path.join(self.directory, database, table,
+                                 'date={date}'.format(date=self.now))
+        os.makedirs(directory, exist_ok=True)
+        # parts left by an interrupted run are never overwritten
+        count = self.part_counts.get(key, 0)
+        path = os.path.join(directory, 'part-{n}.parquet'.format(n=count))
+        while os.path.exists(path):
+            count += 1
+            path = os.path.join(directory,
+                                'part-{n}.parquet'.format(n=count))
+        self.part_counts[key] = count + 1
+        compression = self.compression \
+            if self.compression in PARQUET_COMPRESSIONS else 'snappy'
+        writer = pyarrow.parquet.ParquetWriter(
+            path,
+            self.arrow_schema(database=database, table=table,
+                              columns=columns),
+            compression=compression)
+        self.handlers[path] = {'file': path, 'fh': writer}
+        self.parts[key] = (path, writer, 0)
+        return self.parts[key]
+
+    def write(self, database=None, table=None, data=None):
+        """
+        The write method which should be implemented because of ineherited
+        Formatter class.
+        Each set of data is written as a row group of the current part file of
+        the table
+        """
+        if self.dry_run:
+            logging.debug("[DRY RUN] No data written for %s.%s", database,
+                          table)
+            return
+
+        (path, writer, rows) = self.part(database=database,
+                                         table=table,
+                                         columns=data.columns)
+        arrays = [
+            pyarrow.array(self.column_values(values=[r[i] for r in data.rows],
+                                             arrow_type=field.type),
+                          type=field.type)
+            for (i, field) in enumerate(writer.schema)
+        ]
+        writer.write_table(
+            pyarrow.Table.from_arrays(arrays, schema=writer.schema))
+        self.parts['{db}.{table}'.format(db=database,
+                                         table=table)] = (path, writer,
+                                                          rows + len(data))
+        logging.info("%s formatter: writing %s lines in %s", self.name,
+                     len(data), path)
+
+    def flushable(self):
+        """
+        A Parquet file is readable once closed only
+        """
+        return False
+
+    def rollover(self):
+        """
+        Close the current parts and sync all the parts to the disk, the next
+        sets of data are written in new parts
+        """
+        self.close()
+        for handler in self.handlers.values():
+            handler['size'] = self.sync(path=handler['file'])
+
+    def close(self):
+        """
+        Close the part files which are still open
+        """
+        for (path, writer, _) in self.parts.values():
+            logging.info("Closing handler of %s", path)
+            writer.close()
+        self.parts = {}
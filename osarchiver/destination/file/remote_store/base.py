@@ -7,6 +7,7 @@ RemoteStore abstract base class file
 """
 
 from abc import ABCMeta, abstractmethod
+import os
 import arrow
 import re
 
@@ -16,17 +17,31 @@ class RemoteStore(metaclass=ABCMeta):
     The RemoteStore abstract class
     """
 
-    def __init__(self, name=None, backend='swift', date=None, store_options={}):
+    def __init__(self, name=None, backend='swift', date=None, store_options={},
+                 directory=None):
         """
-        RemoteStore object is defined by a name and a backend
+        RemoteStore object is defined by a name and a backend, the files are
+        named remotely from their path relative to the directory
         """
         self.name = name
+        self.directory = directory
         self.date = date or arrow.now().strftime('%F_%T')
         self.backend = backend
         self.store_options = {
             re.sub('^opt_', '', k): v for k, v in store_options.items() if k.startswith('opt_')
         }
 
+    def relative_path(self, path=None):
+        """
+        Return the path of a file relative to the directory, its name if it
+        is not in the directory
+        """
+        if self.directory is not None:
+            relative_path = os.path.relpath(path, self.directory)
+            if not relative_path.startswith(os.pardir):
+                return relative_path
+        return os.path.basename(path)
+
     @abstractmethod
     def send(self, files=[]):
         """
@@ -8,7 +8,6 @@ This module use the high level module SwiftService
 """
 
 import logging
-from os.path import basename
 from swiftclient.service import SwiftError, SwiftService, SwiftUploadObject
 
 from osarchiver.destination.file.remote_store import RemoteStore
@@ -19,12 +18,14 @@ class Swift(RemoteStore):
     Swift class used to send log remotely on openstack's swift backend
     """
 
-    def __init__(self, name=None, date=None, store_options={}):
+    def __init__(self, name=None, date=None, store_options={},
+                 directory=None):
         """
         instance osarchiver.remote_log.swift class
         """
         RemoteStore.__init__(self, backend='swift', name=name,
-                             date=date, store_options=store_options)
+                             date=date, store_options=store_options,
+                             directory=directory)
         self.container = store_options.get('container', None)
         self.file_name_prefix = store_options.get('file_name_prefix', '')
         self.service = None
@@ -42,7 +43,7 @@ class Swift(RemoteStore):
                                   object_name='%s/%s/%s' % (
                                       self.file_name_prefix,
                                       self.date,
-                                      basename(f))
+                                      self.relative_path(f))
                                   ) for f in files]
             for r in swift.upload(self.container, file_objects):
                 if r['success']:
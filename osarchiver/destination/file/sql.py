@@ -14,8 +14,8 @@ from osarchiver.destination.file.base import Formatter
 
 class Sql(Formatter):
     """
-    The class implement a formatter of SQL type which is able to convert a list
-    of dict of data into one file of SQL statement
+    The class implement a formatter of SQL type which is able to convert a
+    Batch of data into one file of SQL statement
     """
 
     def get_handler(self, handler=None, file_to_handle=None):
@@ -24,10 +24,9 @@ class Sql(Formatter):
         """
         if handler not in self.handlers:
             self.handlers[handler] = {}
-            self.handlers[handler]['file'] = file_to_handle
-            self.handlers[handler]['fh'] = open(file_to_handle,
-                                                'w',
-                                                encoding='utf-8')
+            (self.handlers[handler]['file'],
+             self.handlers[handler]['fh']) = self.open_file(
+                 path=file_to_handle)
 
         return self.handlers[handler]['fh']
 
@@ -35,7 +34,8 @@ class Sql(Formatter):
         """
         The write method which should be implemented because of ineherited
         Formatter class
-        The name of the file is of the form <database>.<table>.sql
+        The name of the file is of the form <database>.<table>.sql, followed
+        by the extension of the compression if any
         The SQL statement is:
             INSERT INTO <database>.<table> (col1, col2, ... ) VALUES
             (val1, val2, ... )
@@ -48,17 +48,17 @@ class Sql(Formatter):
         key = '{db}.{table}'.format(db=database, table=table)
 
         writer = self.get_handler(handler=key, file_to_handle=destination_file)
+        destination_file = self.handlers[key]['file']
         lines = []
         primary_key = self.source.get_table_primary_key(database=database,
                                                         table=table)
+        # Build columns insert part once for the whole set
+        columns = '`' + '`, `'.join(data.columns) + '`'
         for item in data:
-            # Build columns insert part
-            # iterate over keys or values of dict is consitent in python 3
-            columns = '`' + '`, `'.join(item.keys()) + '`'
             # SQL scaping, None is changed to NULL
             values = [
                 pymysql.escape_string(str(v)) if v is not None else 'NULL'
-                for v in item.values()
+                for v in item
             ]
             placeholders = "'" + "', '".join(values) + "'"
             # Remove the simple quote around NULL statement to be understood as
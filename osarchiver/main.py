@@ -48,6 +48,11 @@ def parse_args():
                         ' really deleting or writing data',
                         default=False,
                         action='store_true')
+    parser.add_argument('--resume',
+                        help='Resume the archivers from the checkpoint of'
+                        ' an interrupted run',
+                        default=False,
+                        action='store_true')
     args = parser.parse_args()
 
     if args.debug:
@@ -83,7 +88,9 @@ def run():
     """
     try:
         args = parse_args()
-        config = Config(file_path=args.config, dry_run=args.dry_run)
+        config = Config(file_path=args.config,
+                        dry_run=args.dry_run,
+                        resume=args.resume)
         configure_logger(level=args.log_level, log_file=args.log_file)
 
         for archiver in config.archivers:
@@ -0,0 +1,157 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+The TableScheduler class file
+
+The scheduler runs the archiving of the tables of a database on a pool of
+workers. The child first ordering of the tables is turned into a dependency
+graph: a table is started only once all the tables referencing it with a
+foreign key are archived, independent tables are archived concurrently.
+Large tables split into primary key ranges are archived by several workers,
+such a table is done once all its ranges are.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class TableScheduler():
+    """
+    Schedule the archiving of tables of a database over a pool of workers.
+    Each worker is a clone of the archiver with its own Source and
+    Destination connections.
+    """
+
+    def __init__(self, archiver=None, workers=1):
+        """
+        instantiator, take the archiver to clone and the size of the pool
+        """
+        self.archiver = archiver
+        self.workers = max(int(workers), 1)
+        self._idle_workers = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def get_worker(self):
+        """
+        Return an idle worker, create a new one if none is available
+        """
+        try:
+            return self._idle_workers.get_nowait()
+        except queue.Empty:
+            worker = self.archiver.clone()
+            with self._lock:
+                self._workers.append(worker)
+            logging.debug("Archiver %s: %s workers started",
+                          self.archiver.name, len(self._workers))
+            return worker
+
+    def run_table(self, database=None, table=None, key_range=None,
+                  part=None):
+        """
+        Archive one table, or one key range of a table, with an idle worker
+        """
+        worker = self.get_worker()
+        try:
+            worker.run_table(database=database,
+                             table=table,
+                             key_range=key_range,
+                             part=part)
+        finally:
+            self._idle_workers.put(worker)
+
+    def close(self):
+        """
+        Close connections of all the workers
+        """
+        for worker in self._workers:
+            self.archiver.close_clone(worker)
+        self._workers = []
+
+    def run(self, database=None):
+        """
+        Archive all the tables of a database. The tables ready to be archived,
+        (those which have no remaining child table) are started by decreasing
+        estimated number of rows so that the largest tables are not the last
+        to run.
+        """
+        src = self.archiver.src
+        tables = src.tables_to_archive(database=database)
+        if not tables:
+            return
+        dependencies = src.table_dependencies(database=database)
+        rows_estimate = src.get_tables_rows_estimate(database=database)
+
+        def priority(table):
+            return (-rows_estimate.get(table, 0), tables.index(table))
+
+        # For each table the set of children not yet archived
+        pending = {t: set(dependencies.get(t, set())) for t in tables}
+        # For each started table the number of key ranges not yet archived
+        remaining = {}
+        # (table, part, key range) ready to be started
+        jobs = []
+        running = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                try:
+                    while pending or jobs or running:
+                        ready = sorted([t for t in pending if not pending[t]],
+                                       key=priority)
+                        if not ready and not jobs and not running:
+                            # Circular foreign keys: fallback on the child
+                            # first order to break the cycle
+                            table = min(pending, key=tables.index)
+                            logging.warning(
+                                "Circular dependencies detected for %s.%s, "
+                                "starting it anyway", database, table)
+                            ready = [table]
+
+                        for table in ready:
+                            del pending[table]
+                            ranges = self.archiver.table_key_ranges(
+                                database=database, table=table)
+                            remaining[table] = len(ranges)
+                            if len(ranges) == 1:
+                                jobs.append((table, None, None))
+                            else:
+                                jobs.extend([(table, part, key_range)
+                                             for (part, key_range)
+                                             in enumerate(ranges)])
+                        jobs.sort(key=lambda job: priority(job[0]))
+
+                        while jobs and len(running) < self.workers:
+                            (table, part, key_range) = jobs.pop(0)
+                            logging.info("Scheduling archiving of %s.%s%s",
+                                         database, table,
+                                         '' if part is None else
+                                         ' range {}'.format(key_range))
+                            future = executor.submit(self.run_table,
+                                                     database=database,
+                                                     table=table,
+                                                     key_range=key_range,
+                                                     part=part)
+                            running[future] = table
+
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            table = running.pop(future)
+                            # re-raise the exception of the worker if any
+                            future.result()
+                            remaining[table] -= 1
+                            if remaining[table]:
+                                continue
+                            logging.info("Archiving of %s.%s is done",
+                                         database, table)
+                            for children in pending.values():
+                                children.discard(table)
+                except BaseException:
+                    # Ask the running workers to stop as soon as possible,
+                    # leaving the executor waits for them
+                    self.archiver.stop_event.set()
+                    raise
+        finally:
+            self.close()
@@ -10,10 +10,10 @@ import time
 import logging
 import pymysql
 import arrow
-from numpy import array_split
 from osarchiver.source import Source
 from osarchiver.common.db import DbBase
-from sqlalchemy import inspect
+from osarchiver.common.batch import Batch, BatchCursor, SSBatchCursor
+from osarchiver.common.throttle import Throttle
 import sqlalchemy_utils
 
 NOT_OS_DB = ['mysql', 'performance_schema', 'information_schema']
@@ -34,6 +34,23 @@ class Db(Source, DbBase):
                  archive_data=None,
                  name=None,
                  destination=None,
+                 database_concurrency=1,
+                 select_streaming=False,
+                 select_streaming_timeout=3600,
+                 skip_empty_tables=True,
+                 range_partitions=1,
+                 range_partition_min_rows=1000000,
+                 scan_strategy='auto',
+                 scan_selectivity_threshold=0.05,
+                 check_blocking_children=True,
+                 delete_by_range=True,
+                 throttle=False,
+                 throttle_max_delay=60,
+                 throttle_max_threads_running=50,
+                 throttle_max_history_length=1000000,
+                 throttle_max_replication_lag=10,
+                 throttle_max_flow_control=0.1,
+                 throttle_min_chunk_ratio=0.1,
                  **kwargs):
         """
         Create a Source instance with relevant configuration parameters given
@@ -55,6 +72,35 @@ class Db(Source, DbBase):
         self._databases_to_archive = []
         self._tables_to_archive = {}
         self.tables_with_circular_fk = []
+        # number of databases archived concurrently
+        self.database_concurrency = int(database_concurrency)
+        # read tables with one unbuffered query instead of one query per set
+        self.select_streaming = select_streaming
+        # how long the server waits for the client to read the stream
+        self.select_streaming_timeout = int(select_streaming_timeout)
+        # probe tables and skip those without data to archive
+        self.skip_empty_tables = skip_empty_tables
+        # number of primary key ranges a large table is split into
+        self.range_partitions = int(range_partitions)
+        # estimated number of rows from which a table is split
+        self.range_partition_min_rows = int(range_partition_min_rows)
+        # how tables are walked: pk, deleted_column or auto
+        if scan_strategy not in ['auto', 'pk', 'deleted_column']:
+            raise ValueError("Unsupported scan_strategy '{}'".format(
+                scan_strategy))
+        self.scan_strategy = scan_strategy
+        # maximal ratio of rows to archive for which the deleted_column index
+        # is walked in auto mode
+        self.scan_selectivity_threshold = float(scan_selectivity_threshold)
+        # scan plan per database.table, shared with the clones
+        self.scan_plans = {}
+        # select only the keys of the rows, set when no destination needs
+        # the content of the rows
+        self.select_keys_only = False
+        # exclude from the deletes the rows which still have children
+        self.check_blocking_children = check_blocking_children
+        # delete contiguous integer keys with BETWEEN instead of IN lists
+        self.delete_by_range = delete_by_range
         # When selecting data be sure to use the same date to prevent selecting
         # parent data newer than children data, it is of the responsability of
         # the operator to use the {now} formating value in the configuration
@@ -66,6 +112,18 @@ class Db(Source, DbBase):
         Source.__init__(self, backend='db', name=name,
                         conf=kwargs.get('conf', None))
         DbBase.__init__(self, **kwargs)
+        # pace the deletes depending on the load of the server, the
+        # delete_loop_delay being the minimal delay
+        self.throttle = None
+        if throttle:
+            self.throttle = Throttle(
+                min_delay=self.delete_loop_delay,
+                max_delay=throttle_max_delay,
+                max_threads_running=throttle_max_threads_running,
+                max_history_length=throttle_max_history_length,
+                max_replication_lag=throttle_max_replication_lag,
+                max_flow_control=throttle_max_flow_control,
+                min_chunk_ratio=throttle_min_chunk_ratio)
 
     def __repr__(self):
         return "Source {name} [Backend:{backend} Host:{host} - DB:{db} - "\
@@ -128,6 +186,7 @@ class Db(Source, DbBase):
         parameter)
         - Exclude tables in excluded_tables
         - Reorder tables depending foreign key
+        - Skip tables without data to archive (skip_empty_tables parameter)
         """
         if database is None:
             logging.warning("Can not call tables_to_archive on None database")
@@ -135,9 +194,7 @@ class Db(Source, DbBase):
         if database in self._tables_to_archive:
             return self._tables_to_archive[database]
 
-        database_tables = [
-            v[0] for (i, v) in enumerate(self.get_database_tables(database))
-        ]
+        database_tables = self.get_schema(database=database).table_names()
         logging.info("Tables list of database '%s': %s", database,
                      database_tables)
         # Step 1: is to get all the tables we want to archive
@@ -177,19 +234,76 @@ class Db(Source, DbBase):
         # table and order them childs first, parents then
         sorted_tables = self.sort_tables(
             database=database, tables=self._tables_to_archive[database])
-        self._tables_to_archive[database] = sorted_tables
 
         logging.debug(
             "Tables ordered depending foreign key dependencies: "
-            "'%s'", self._tables_to_archive[database])
+            "'%s'", sorted_tables)
+
+        # Step 5: probe the tables and remove those without data to archive,
+        # tables added by the sort (parents) are probed only if they are
+        # known to have the deleted column
+        if self.skip_empty_tables:
+            probed_tables = [
+                t for t in sorted_tables
+                if t in self._tables_to_archive[database]
+            ]
+            tables_with_data = self.tables_with_data_to_archive(
+                database=database, tables=probed_tables)
+            skipped_tables = [
+                t for t in probed_tables if t not in tables_with_data
+            ]
+            logging.info("Skipping %s tables of '%s' without data to "
+                         "archive: %s", len(skipped_tables), database,
+                         skipped_tables)
+            sorted_tables = [
+                t for t in sorted_tables if t not in skipped_tables
+            ]
+
+        self._tables_to_archive[database] = sorted_tables
         return self._tables_to_archive[database]
 
+    def tables_with_data_to_archive(self, database=None, tables=None,
+                                    chunk_size=50):
+        """
+        Return the list of tables of a database which have at least one row
+        to archive. Tables are probed by chunk of chunk_size tables with one
+        query:
+            (SELECT '<table1>' FROM <db>.<table1> WHERE ... LIMIT 1)
+            UNION ALL
+            (SELECT '<table2>' FROM <db>.<table2> WHERE ... LIMIT 1) ...
+        In case of error, the tables of the chunk are considered as having
+        data to archive
+        """
+        tables = tables or []
+        tables_with_data = []
+        for start in range(0, len(tables), chunk_size):
+            chunk = tables[start:start + chunk_size]
+            sql = ' UNION ALL '.join([
+                "(SELECT {name} FROM `{database}`.`{table}` WHERE {where} "
+                "LIMIT 1)".format(name=self.connection.escape(table),
+                                  database=database,
+                                  table=table,
+                                  where=self.where) for table in chunk
+            ])
+            try:
+                result = self.db_request(sql=sql,
+                                         database=database,
+                                         fetch_method='fetchall')
+            except pymysql.Error as sql_exception:
+                logging.warning("Unable to probe tables %s of '%s': %s", chunk,
+                                database, sql_exception.args)
+                tables_with_data.extend(chunk)
+                continue
+            tables_with_data.extend([r[0] for r in result])
+
+        return tables_with_data
+
     def sort_tables(self, database=None, tables=[]):
         """
         Given a DB and a list of tables return the list orderered depending
         foreign key check in order to get child table before parent table
         """
-        inspector = inspect(self.sqlalchemy_engine)
+        schema = self.get_schema(database=database)
         sorted_tables = []
         logging.debug("Tables to sort: %s", sorted_tables)
         for table in tables:
@@ -199,10 +313,10 @@ class Db(Source, DbBase):
                 logging.debug("Table %s added to final list", table)
                 sorted_tables.append(table)
             idx = sorted_tables.index(table)
-            fks = inspector.get_foreign_keys(table, schema=database)
+            fks = schema.foreign_keys_of(table=table)
             logging.debug("Foreign keys of %s: %s", table, fks)
             for fk in fks:
-                t = fk['referred_table']
+                t = fk['referenced_table']
 
                 if t in sorted_tables:
                     if sorted_tables.index(t) > idx:
@@ -213,7 +327,8 @@ class Db(Source, DbBase):
 
         return sorted_tables
 
-    def select(self, limit=None, database=None, table=None):
+    def select(self, limit=None, database=None, table=None,
+               last_selected_id=None, max_selected_id=None):
         """
         select data from a database.table, apply limit or take the default one
         the select by set depends of the primary key type (int vs uuid)
@@ -222,33 +337,248 @@ class Db(Source, DbBase):
         In case of uuid (uuid are not ordered naturally ordered, we sort them)
             SELECT * FROM <db>.<table> WHERE <pk> > "<last_selected_id>" AND...
             ORDER BY <pk>
+        The select starts after last_selected_id and stops at max_selected_id
+        (included) if given, max_selected_id is only supported for tables
+        with a single column primary key.
+        The rows are walked following the scan plan of the table, either by
+        primary key or by deleted column index.
+        """
+        plan = self.scan_plan(database=database, table=table)
+        if last_selected_id is not None and \
+                not self.is_scan_key(plan=plan, key=last_selected_id):
+            logging.warning(
+                "Ignoring start key %s of %s.%s which does not match the %s "
+                "scan", last_selected_id, database, table, plan['strategy'])
+            last_selected_id = None
+
+        if self.select_streaming:
+            return self.select_stream(limit=limit,
+                                      database=database,
+                                      table=table,
+                                      last_selected_id=last_selected_id,
+                                      max_selected_id=max_selected_id)
+        return self.select_by_set(limit=limit,
+                                  database=database,
+                                  table=table,
+                                  last_selected_id=last_selected_id,
+                                  max_selected_id=max_selected_id)
+
+    def select_stream(self, limit=None, database=None, table=None,
+                      last_selected_id=None, max_selected_id=None):
+        """
+        select data from a database.table with one query read through an
+        unbuffered server side cursor on a dedicated connection:
+            SELECT * FROM <db>.<table> WHERE ... ORDER BY <pk>
+        The rows are fetched by set of limit rows so the memory used does not
+        depend on the size of the table. If the stream is broken the select
+        continues by set of data starting after the last row read.
+        The stream starts after last_selected_id and stops at max_selected_id
+        if given.
+        """
+        primary_keys = self.get_table_primary_keys(database=database,
+                                                   table=table)
+        if limit is None:
+            limit = self.get_limit(database=database,
+                                   table=table,
+                                   name='select_limit')
+        plan = self.scan_plan(database=database, table=table)
+        columns = plan['columns']
+
+        key_condition = self.scan_condition(plan=plan)
+        if last_selected_id is not None:
+            key_condition += self.sql_keys_greater_than(
+                columns=columns,
+                values=last_selected_id
+                if len(columns) > 1 else [last_selected_id]) + ' AND '
+        if max_selected_id is not None:
+            key_condition += "`{pk}` <= {max_id} AND ".format(
+                pk=primary_keys[0],
+                max_id=self.connection.escape(max_selected_id))
+        sql = "SELECT {columns} FROM `{database}`.`{table}`{index_hint} "\
+            "WHERE {key_condition}{where} ORDER BY {order_by}".format(
+                columns=self.select_columns(database=database, table=table),
+                database=database,
+                table=table,
+                index_hint=self.scan_index_hint(plan=plan),
+                key_condition=key_condition,
+                where=self.where,
+                order_by=', '.join(['`{c}`'.format(c=c) for c in columns]))
+        connection = None
+        try:
+            connection = self.new_connection()
+            cursor = connection.cursor(SSBatchCursor)
+            # The server aborts the query if the client does not read the
+            # stream during net_write_timeout, which happens while the data
+            # are archived and deleted
+            cursor.execute("SET SESSION net_write_timeout = "
+                           "{timeout}".format(
+                               timeout=self.select_streaming_timeout))
+            self._db_execute(sql=sql, cursor=cursor, method='execute')
+            while True:
+                result = self._db_fetch(fetch_method='fetchmany',
+                                        cursor=cursor,
+                                        fetch_args={'size': limit})
+                logging.info("Fetched %s result in %s.%s", len(result),
+                             database, table)
+                if not result:
+                    return
+                last_selected_id = result.row_key(row=result[-1],
+                                                  columns=columns)
+                yield result
+        except pymysql.Error as sql_exception:
+            logging.warning(
+                "Streaming of %s.%s failed (%s), continuing by set of data "
+                "after %s", database, table, sql_exception.args,
+                last_selected_id)
+        finally:
+            # Closing the connection rather than the cursor prevents reading
+            # the remaining rows of the stream
+            if connection is not None and connection.open:
+                connection.close()
+
+        yield from self.select_by_set(limit=limit,
+                                      database=database,
+                                      table=table,
+                                      last_selected_id=last_selected_id,
+                                      max_selected_id=max_selected_id)
+
+    def select_by_set(self, limit=None, database=None, table=None,
+                      last_selected_id=None, max_selected_id=None):
+        """
+        select data from a database.table by set of limit rows, each set is
+        selected with a new query starting after the last row of the
+        previous set
+        If limit is not given, the select_limit is adapted after each set
+        when target_statement_time is set
         """
         offset = 0
-        last_selected_id = 0
+
+        adaptive = limit is None
+        if limit is None:
+            limit = self.get_limit(database=database,
+                                   table=table,
+                                   name='select_limit')
 
         # Use primary key column to improve performance on large
         # dataset vs using OFFSET
-        primary_key = self.get_table_primary_key(database=database,
-                                                 table=table)
+        primary_keys = self.get_table_primary_keys(database=database,
+                                                   table=table)
+        plan = self.scan_plan(database=database, table=table)
+        if plan['strategy'] == 'deleted_column':
+            yield from self.select_by_composite_key(
+                limit=limit,
+                database=database,
+                table=table,
+                primary_keys=plan['columns'],
+                last_selected_key=last_selected_id,
+                adaptive=adaptive,
+                index=plan['index'],
+                condition=self.scan_condition(plan=plan))
+            return
+        if len(primary_keys) > 1:
+            yield from self.select_by_composite_key(
+                limit=limit,
+                database=database,
+                table=table,
+                primary_keys=primary_keys,
+                last_selected_key=last_selected_id,
+                adaptive=adaptive)
+            return
+        primary_key = primary_keys[0]
 
-        if limit is None:
-            limit = self.select_limit
+        # Upper bound of the key range to select
+        max_condition = ''
+        if max_selected_id is not None:
+            max_condition = "`{pk}` <= {max_id} AND ".format(
+                pk=primary_key,
+                max_id=self.connection.escape(max_selected_id))
+
+        # The type of the primary key is known from the schema
+        if self.get_schema(database=database).primary_key_is_integer(
+                table=table):
+            sql = "SELECT {columns} FROM `{database}`.`{table}` WHERE "\
+                "`{pk}` > {last_id} AND {max_condition}{where} LIMIT {limit}"
+            if last_selected_id is None:
+                last_selected_id = 0
+        else:
+            # else this a string and we force to order by that string
+            # to simulate an integer primary key
+            sql = "SELECT {columns} FROM `{database}`.`{table}` WHERE "\
+                "`{pk}` > {last_id} AND {max_condition}{where} ORDER BY "\
+                "`{pk}` LIMIT {limit}"
+            if last_selected_id is None:
+                last_selected_id = ''
 
-        sql = "SELECT * FROM `{database}`.`{table}` WHERE {pk} > "\
-            "'{last_id}' AND {where} LIMIT {limit}"
+        columns = self.select_columns(database=database, table=table)
+        while True:
+            formatted_sql = sql.format(
+                columns=columns,
+                database=database,
+                table=table,
+                where=self.where,
+                limit=limit,
+                last_id=self.connection.escape(last_selected_id),
+                max_condition=max_condition,
+                pk=primary_key,
+                offset=offset)
+            result = self.db_request(sql=formatted_sql,
+                                     cursor_type=BatchCursor,
+                                     database=database,
+                                     table=table,
+                                     fetch_method='fetchall')
+            logging.info("Fetched %s result in %s.%s", len(result), database,
+                         table)
+            if not result:
+                break
+            last_selected_id = result.row_key(row=result[-1],
+                                              columns=primary_keys)
+            if adaptive:
+                limit = self.update_limit(
+                    database=database,
+                    table=table,
+                    name='select_limit',
+                    duration=self.last_execute_duration,
+                    rows=len(result)) or limit
 
-        pk_type_checked = False
+            yield result
 
+            offset += len(result)
+
+    def select_by_composite_key(self, limit=None, database=None, table=None,
+                                primary_keys=None, last_selected_key=None,
+                                adaptive=False, index=None, condition=''):
+        """
+        select data from a database.table which has a composite primary key
+        by set of limit rows, the set of data starts after the key of the last
+        row of the previous set:
+            SELECT * FROM <db>.<table> WHERE (<pk1>, <pk2>) > (<v1>, <v2>)
+            AND ... ORDER BY <pk1>, <pk2>
+        The same walk is used over an index with the (<deleted_column>, <pk>)
+        cursor, index being the index to force and condition an extra SQL
+        condition ending with AND
+        """
+        order_by = ', '.join(['`{c}`'.format(c=c) for c in primary_keys])
+        index_hint = ''
+        if index is not None:
+            index_hint = ' FORCE INDEX (`{index}`)'.format(index=index)
+        columns = self.select_columns(database=database, table=table)
         while True:
-            formatted_sql = sql.format(database=database,
+            key_condition = condition
+            if last_selected_key is not None:
+                key_condition += self.sql_keys_greater_than(
+                    columns=primary_keys, values=last_selected_key) + ' AND '
+            sql = "SELECT {columns} FROM `{database}`.`{table}`{index_hint} "\
+                "WHERE {key_condition}{where} ORDER BY {order_by} "\
+                "LIMIT {limit}".format(columns=columns,
+                                       database=database,
                                        table=table,
+                                       index_hint=index_hint,
+                                       key_condition=key_condition,
                                        where=self.where,
-                                       limit=limit,
-                                       last_id=last_selected_id,
-                                       pk=primary_key,
-                                       offset=offset)
-            result = self.db_request(sql=formatted_sql,
-                                     cursor_type=pymysql.cursors.DictCursor,
+                                       order_by=order_by,
+                                       limit=limit)
+            result = self.db_request(sql=sql,
+                                     cursor_type=BatchCursor,
                                      database=database,
                                      table=table,
                                      fetch_method='fetchall')
@@ -256,101 +586,393 @@ class Db(Source, DbBase):
                          table)
             if not result:
                 break
-            last_selected_id = result[-1][primary_key]
+            last_selected_key = result.row_key(row=result[-1],
+                                               columns=primary_keys)
+            if adaptive:
+                limit = self.update_limit(
+                    database=database,
+                    table=table,
+                    name='select_limit',
+                    duration=self.last_execute_duration,
+                    rows=len(result)) or limit
 
             yield result
 
-            offset += len(result)
-            if pk_type_checked is False:
-                # If the primary key is a digit remove the simple quote from
-                # the last_id variable for performance purpose
-                if str(last_selected_id).isdigit():
-                    # remove the simple quote arround id
-                    sql = "SELECT * FROM `{database}`.`{table}` WHERE {pk} >"\
-                        " {last_id} AND {where} LIMIT {limit}"
-                else:
-                    # else this a string and we force to order by that string
-                    # to simulate an integer primary key
-                    sql = "SELECT * FROM `{database}`.`{table}` WHERE {pk} >"\
-                        " '{last_id}' AND {where} ORDER BY {pk} LIMIT {limit}"
-
-                pk_type_checked = True
-
-    def read(self, limit=None):
+    def select_columns(self, database=None, table=None):
+        """
+        Return the SQL list of the columns to select: all of them, or when
+        select_keys_only is set the columns needed to delete the rows: the
+        primary key, the cursor of the scan plan and the columns referenced
+        by child tables
+        """
+        if not self.select_keys_only:
+            return '*'
+        schema = self.get_schema(database=database)
+        needed_columns = list(
+            self.scan_plan(database=database, table=table)['columns'])
+        needed_columns.extend(schema.primary_keys(table=table))
+        for fk in schema.foreign_keys_referencing(table=table):
+            needed_columns.extend(fk['referenced_columns'])
+        columns = []
+        for column in needed_columns:
+            if column not in columns:
+                columns.append(column)
+        return ', '.join(['`{c}`'.format(c=c) for c in columns])
+
+    def scan_plan(self, database=None, table=None):
+        """
+        Return how the rows of a table are walked, the plan is chosen once
+        per table. It is a dict with:
+        - strategy: pk to walk the primary key, deleted_column to walk an
+          index of the deleted column
+        - columns: the columns of the cursor, ordered, whose values in the
+          last row read are the start of the next set
+        - index: the index to force, None for the primary key
+        """
+        if (database, table) not in self.scan_plans:
+            self.scan_plans[(database, table)] = self.choose_scan_plan(
+                database=database, table=table)
+        return self.scan_plans[(database, table)]
+
+    def choose_scan_plan(self, database=None, table=None):
+        """
+        Choose the scan plan of a table depending on scan_strategy. In auto
+        mode the index of the deleted column is walked if the optimizer uses
+        it for the where condition and the estimated ratio of rows to archive
+        is under scan_selectivity_threshold, otherwise the primary key is
+        walked. The rows whose deleted column is NULL are never selected
+        through the index.
+        """
+        schema = self.get_schema(database=database)
+        primary_keys = schema.primary_keys(table=table)
+        pk_plan = {'strategy': 'pk', 'columns': primary_keys, 'index': None}
+        if self.scan_strategy == 'pk':
+            return pk_plan
+
+        index = schema.index_starting_with(table=table,
+                                           column=self.deleted_column)
+        if index in [None, 'PRIMARY'] or self.deleted_column in primary_keys:
+            logging.info("Scan plan of %s.%s: primary key walk, '%s' is not "
+                         "indexed", database, table, self.deleted_column)
+            return pk_plan
+        index_plan = {
+            'strategy': 'deleted_column',
+            'columns': [self.deleted_column] + primary_keys,
+            'index': index
+        }
+        if self.scan_strategy == 'deleted_column':
+            logging.info("Scan plan of %s.%s: '%s' index walk", database,
+                         table, index)
+            return index_plan
+
+        rows_to_archive = self.estimate_rows_to_archive(database=database,
+                                                        table=table,
+                                                        index=index)
+        if rows_to_archive is None:
+            logging.info("Scan plan of %s.%s: primary key walk, the '%s' "
+                         "index is not used by the where condition", database,
+                         table, index)
+            return pk_plan
+        selectivity = rows_to_archive / max(
+            schema.rows_estimate(table=table), 1)
+        if selectivity > self.scan_selectivity_threshold:
+            logging.info("Scan plan of %s.%s: primary key walk, %s%% of the "
+                         "rows to archive", database, table,
+                         round(selectivity * 100, 2))
+            return pk_plan
+        logging.info("Scan plan of %s.%s: '%s' index walk, %s%% of the rows "
+                     "to archive", database, table, index,
+                     round(selectivity * 100, 2))
+        return index_plan
+
+    def estimate_rows_to_archive(self, database=None, table=None, index=None):
+        """
+        Return the number of rows to archive of a table estimated by the
+        optimizer with EXPLAIN, None if the plan does not use the given index
+        """
+        sql = "EXPLAIN SELECT * FROM `{database}`.`{table}` WHERE "\
+            "{where}".format(database=database, table=table, where=self.where)
+        try:
+            explain = self.db_request(sql=sql,
+                                      database=database,
+                                      table=table,
+                                      cursor_type=pymysql.cursors.DictCursor,
+                                      fetch_method='fetchall')
+        except pymysql.Error as sql_exception:
+            logging.warning("Unable to explain the select of %s.%s: %s",
+                            database, table, sql_exception.args)
+            return None
+        logging.debug("Explain of the select of %s.%s: %s", database, table,
+                      explain)
+        if not explain or explain[0].get('key') != index:
+            return None
+        return int(explain[0].get('rows') or 0)
+
+    def scan_condition(self, plan=None):
+        """
+        Return the SQL condition, ending with AND, required by a scan plan
+        """
+        if plan['strategy'] == 'deleted_column':
+            return "`{column}` IS NOT NULL AND ".format(
+                column=self.deleted_column)
+        return ''
+
+    @staticmethod
+    def scan_index_hint(plan=None):
+        """
+        Return the index hint of a scan plan
+        """
+        if plan['index'] is None:
+            return ''
+        return ' FORCE INDEX (`{index}`)'.format(index=plan['index'])
+
+    @staticmethod
+    def is_scan_key(plan=None, key=None):
+        """
+        Return True if a key, given as start of a select, matches the cursor
+        of a scan plan: a single value or a sequence of a value per column
+        """
+        if len(plan['columns']) == 1:
+            return not isinstance(key, (list, tuple))
+        return isinstance(key, (list, tuple)) and \
+            len(key) == len(plan['columns'])
+
+    def table_key_ranges(self, database=None, table=None):
+        """
+        Split the primary key space of a large table into range_partitions
+        disjoint ranges which can be archived concurrently. A range is a
+        tuple (last_selected_id, max_selected_id): the keys greater than the
+        first bound and lower or equal to the second one, None being
+        unbounded. The first and last ranges are unbounded so that the whole
+        table is covered.
+        Integer keys are split evenly between their MIN and MAX, other keys
+        on the quantiles of a sample of the keys.
+        Tables with a composite primary key, a foreign key to themselves or
+        walked by deleted column index are not split.
+        """
+        whole_table = [(None, None)]
+        if self.range_partitions < 2:
+            return whole_table
+        if self.scan_plan(database=database,
+                          table=table)['strategy'] != 'pk':
+            logging.debug("%s.%s is walked by index, not splitting it",
+                          database, table)
+            return whole_table
+        schema = self.get_schema(database=database)
+        if schema.rows_estimate(table=table) < self.range_partition_min_rows:
+            return whole_table
+        primary_keys = schema.primary_keys(table=table)
+        if len(primary_keys) != 1:
+            logging.debug("%s.%s has a composite primary key, not splitting "
+                          "it", database, table)
+            return whole_table
+        if [fk for fk in schema.foreign_keys_of(table=table)
+                if fk['referenced_table'] == table]:
+            logging.debug("%s.%s references itself, not splitting it",
+                          database, table)
+            return whole_table
+
+        if schema.primary_key_is_integer(table=table):
+            bounds = self.integer_key_bounds(database=database,
+                                             table=table,
+                                             primary_key=primary_keys[0])
+        else:
+            bounds = self.sampled_key_bounds(database=database,
+                                             table=table,
+                                             primary_key=primary_keys[0])
+        if not bounds:
+            return whole_table
+
+        starts = [None] + bounds
+        ends = bounds + [None]
+        ranges = list(zip(starts, ends))
+        logging.info("%s.%s split into %s primary key ranges: %s", database,
+                     table, len(ranges), ranges)
+        return ranges
+
+    def integer_key_bounds(self, database=None, table=None, primary_key=None):
+        """
+        Return the range_partitions - 1 bounds which split evenly the
+        interval between the minimal and maximal value of an integer primary
+        key
+        """
+        sql = "SELECT MIN(`{pk}`), MAX(`{pk}`) FROM "\
+            "`{database}`.`{table}`".format(pk=primary_key,
+                                            database=database,
+                                            table=table)
+        (min_id, max_id) = self.db_request(sql=sql,
+                                           database=database,
+                                           table=table,
+                                           fetch_method='fetchone')
+        if min_id is None:
+            return []
+        step = (int(max_id) - int(min_id) + 1) // self.range_partitions
+        if step < 1:
+            return []
+        return [
+            int(min_id) - 1 + step * i for i in range(1, self.range_partitions)
+        ]
+
+    def sampled_key_bounds(self, database=None, table=None, primary_key=None):
+        """
+        Return the range_partitions - 1 quantiles of a random sample of the
+        primary key. The sample is ordered by the server so that the bounds
+        follow the collation of the key.
+        """
+        sample_size = 100 * self.range_partitions
+        ratio = min(
+            1.0, sample_size /
+            max(self.get_schema(database=database).rows_estimate(table=table),
+                1))
+        sql = "SELECT `{pk}` FROM `{database}`.`{table}` WHERE RAND() < "\
+            "{ratio} ORDER BY `{pk}`".format(pk=primary_key,
+                                             database=database,
+                                             table=table,
+                                             ratio=ratio)
+        sample = [
+            row[0] for row in self.db_request(sql=sql,
+                                              database=database,
+                                              table=table,
+                                              fetch_method='fetchall')
+        ]
+        if len(sample) < self.range_partitions:
+            return []
+        bounds = []
+        for i in range(1, self.range_partitions):
+            bound = sample[len(sample) * i // self.range_partitions]
+            if bound not in bounds:
+                bounds.append(bound)
+        return bounds
+
+    def table_dependencies(self, database=None):
+        """
+        For a given database, return a dict which maps each table to archive
+        to the set of tables to archive that reference it with a foreign key.
+        A parent table must be archived only once all its children are.
+        """
+        tables = self.tables_to_archive(database=database)
+        dependencies = {table: set() for table in tables}
+        schema = self.get_schema(database=database)
+        for table in tables:
+            for fk in schema.foreign_keys_of(table=table):
+                parent = fk['referenced_table']
+                if parent in dependencies and parent != table:
+                    dependencies[parent].add(table)
+
+        logging.debug("Tables dependencies of %s: %s", database, dependencies)
+        return dependencies
+
+    def last_selected_key(self, database=None, table=None, data=None):
+        """
+        Return the key of the last row of a set of data, a select started
+        after this key returns the rows following the set
+        """
+        return data.row_key(row=data[-1],
+                            columns=self.scan_plan(database=database,
+                                                   table=table)['columns'])
+
+    def read(self, limit=None, database=None, table=None,
+             last_selected_id=None, max_selected_id=None):
         """
         The read method that has to be implemented (Source abstract class)
+        The database and table parameters restrict the reading to a single
+        database and/or table, last_selected_id and max_selected_id are the
+        bounds of the keys of the table to select
         """
         databases_to_archive = self.databases_to_archive()
+        if database is not None:
+            databases_to_archive = [
+                d for d in databases_to_archive if d == database
+            ]
         logging.info("Database elected for archiving: %s",
                      databases_to_archive)
-        for database in databases_to_archive:
-            tables_to_archive = self.tables_to_archive(database=database)
+        for database_to_archive in databases_to_archive:
+            tables_to_archive = self.tables_to_archive(
+                database=database_to_archive)
+            if table is not None:
+                tables_to_archive = [t for t in tables_to_archive if t == table]
             logging.info("Tables elected for archiving: %s", tables_to_archive)
-            for table in tables_to_archive:
-                logging.info("%s.%s is to archive", database, table)
+            for table_to_archive in tables_to_archive:
+                logging.info("%s.%s is to archive", database_to_archive,
+                             table_to_archive)
                 yield {
                     'database':
-                    database,
+                    database_to_archive,
                     'table':
-                    table,
+                    table_to_archive,
                     'data':
-                    self.select(limit=limit, database=database, table=table)
+                    self.select(limit=limit,
+                                database=database_to_archive,
+                                table=table_to_archive,
+                                last_selected_id=last_selected_id,
+                                max_selected_id=max_selected_id)
                 }
 
     def delete_set(self, database=None, table=None, limit=None, data=None):
         """
         Delete a set of data using the primary_key of table
+        If limit is not given, the delete_limit is adapted after each subset
+        when target_statement_time is set
         """
         if not self.delete_data:
             logging.info(
                 "Ignoring delete step because delete_data is set to"
                 " %s", self.delete_data)
             return
+        adaptive = limit is None
         if limit is None:
-            limit = self.delete_limit
+            limit = self.get_limit(database=database,
+                                   table=table,
+                                   name='delete_limit')
 
-        primary_key = self.get_table_primary_key(database=database,
-                                                 table=table)
+        primary_keys = self.get_table_primary_keys(database=database,
+                                                   table=table)
+        primary_key = primary_keys[0]
 
-        # Check if primary key is a digit to prevent casting by MySQL and
-        # optimize the request, store the value in metadata for caching
-        pk_is_digit = self.get_metadata(database=database,
-                                        table=table,
-                                        key='pk_is_digit')
-        if pk_is_digit is None:
-            pk_is_digit = str(data[0][primary_key]).isdigit()
-            self.add_metadata(database=database,
-                              table=table,
-                              key='pk_is_digit',
-                              value=pk_is_digit)
-
-        def create_array_chunks(array, chunk_size):
-            for i in range(0, len(array), chunk_size):
-                yield array[i:i + chunk_size]
-
-        # For performance purpose split data in subdata of lenght=limit
-        for subdata in list(create_array_chunks(data, limit)):
-            if pk_is_digit:
-                ids = ', '.join([str(d[primary_key]) for d in subdata])
+        # Check if primary key is an integer to prevent casting by MySQL and
+        # optimize the request
+        pk_is_digit = self.get_schema(
+            database=database).primary_key_is_integer(table=table)
+        keys = data.keys(columns=primary_keys)
+
+        # For performance purpose split data in subdata of lenght=limit, the
+        # throttle reduces the size when the server is overloaded
+        start = 0
+        while start < len(keys):
+            size = limit
+            if self.throttle is not None:
+                size = self.throttle.chunk_size(limit=limit)
+            subdata = keys[start:start + size]
+            start += len(subdata)
+            if len(primary_keys) > 1:
+                # composite primary key: (pk1, pk2) IN ((v1, v2), ...)
+                keys_condition = self.sql_keys_in(columns=primary_keys,
+                                                  values=subdata)
+            elif pk_is_digit and self.delete_by_range:
+                keys_condition = self.sql_key_ranges(primary_key=primary_key,
+                                                     keys=subdata)
+            elif pk_is_digit:
+                keys_condition = "`{pk}` IN ({ids})".format(
+                    pk=primary_key, ids=', '.join([str(k) for k in subdata]))
             else:
-                ids = '"' + '", "'.join([str(d['id']) for d in subdata]) + '"'
+                keys_condition = "`{pk}` IN ({ids})".format(
+                    pk=primary_key,
+                    ids=', '.join(
+                        [self.connection.escape(str(k)) for k in subdata]))
 
             total_deleted_count = 0
+            duration = 0
             # equivalent to a while True but we know why we are looping
             while "there are rows to delete":
                 if total_deleted_count > 0:
-                    logging.debug(
-                        "Waiting %s seconds before deleting next"
-                        "subset of data ", self.delete_loop_delay)
-                    time.sleep(int(self.delete_loop_delay))
+                    self.delete_pause()
 
                 sql = "DELETE FROM `{database}`.`{table}` WHERE "\
-                    "`{pk}` IN ({ids}) LIMIT {limit}".format(
+                    "{keys_condition} LIMIT {limit}".format(
                         database=database,
                         table=table,
-                        ids=ids,
-                        pk=primary_key,
-                        limit=limit)
+                        keys_condition=keys_condition,
+                        limit=size)
                 foreign_key_check = None
                 if '{db}.{table}'.format(db=database, table=table) \
                     in self.tables_with_circular_fk:
@@ -363,20 +985,138 @@ class Db(Source, DbBase):
                 logging.info("%s rows deleted from %s.%s", count, database,
                              table)
                 total_deleted_count += count
+                duration += self.last_execute_duration + \
+                    self.last_commit_duration
 
-                if int(count) < int(limit) or \
+                if int(count) < int(size) or \
                         total_deleted_count == len(subdata):
                     logging.debug("No more row to delete in this data set")
                     break
 
-            logging.debug("Waiting %s seconds after a deletion",
-                          self.delete_loop_delay)
-            time.sleep(int(self.delete_loop_delay))
+            if adaptive:
+                limit = self.update_limit(database=database,
+                                          table=table,
+                                          name='delete_limit',
+                                          duration=duration,
+                                          rows=len(subdata)) or limit
+
+            self.delete_pause()
+
+    def delete_pause(self):
+        """
+        Wait between two deletes, delete_loop_delay seconds or, if throttle
+        is enabled, the delay computed from the load of the server
+        """
+        delay = int(self.delete_loop_delay)
+        if self.throttle is not None:
+            delay = self.throttle.delay(connection=self.connection)
+        logging.debug("Waiting %s seconds after a deletion", delay)
+        time.sleep(delay)
+
+    def blocked_rows(self, database=None, table=None, data=None):
+        """
+        Return the set of positions in a set of data of the rows which are
+        still referenced by rows of child tables and can't be deleted. The
+        children are looked for with one query per foreign key referencing
+        the table:
+            SELECT DISTINCT <fk> FROM <db>.<child> WHERE <fk> IN (...)
+        The offending rows are reported.
+        """
+        blocked = set()
+        schema = self.get_schema(database=database)
+        for fk in schema.blocking_foreign_keys(table=table):
+            referenced_keys = data.keys(columns=fk['referenced_columns'])
+            values = set([
+                k for k in referenced_keys
+                if k is not None and not (isinstance(k, tuple) and None in k)
+            ])
+            if not values:
+                continue
+            if len(fk['columns']) > 1:
+                keys_condition = self.sql_keys_in(columns=fk['columns'],
+                                                  values=values)
+            else:
+                keys_condition = "`{column}` IN ({values})".format(
+                    column=fk['columns'][0],
+                    values=', '.join(
+                        [self.connection.escape(v) for v in values]))
+            sql = "SELECT DISTINCT {columns} FROM `{database}`.`{child}` "\
+                "WHERE {keys_condition}".format(
+                    columns=', '.join(
+                        ['`{c}`'.format(c=c) for c in fk['columns']]),
+                    database=database,
+                    child=fk['table'],
+                    keys_condition=keys_condition)
+            result = self.db_request(sql=sql,
+                                     database=database,
+                                     table=fk['table'],
+                                     fetch_method='fetchall')
+            if not result:
+                continue
+            children_keys = set([
+                r[0] if len(fk['columns']) == 1 else tuple(r) for r in result
+            ])
+            positions = [
+                i for (i, k) in enumerate(referenced_keys)
+                if k in children_keys
+            ]
+            blocked.update(positions)
+            logging.warning(
+                "%s rows of %s.%s are not deleted because they are still "
+                "referenced by %s.%s (%s), referenced keys: %s",
+                len(positions), database, table, database, fk['table'],
+                fk['name'], sorted(children_keys, key=str)[:20])
+        return blocked
 
-    def delete(self, database=None, table=None, limit=None, data=None):
+    def sql_key_ranges(self, primary_key=None, keys=None):
+        """
+        Return the SQL condition matching a list of integer keys. The
+        contiguous keys are coalesced into ranges, the where condition being
+        checked again on the ranges for safety, the other keys are matched
+        with an IN list:
+            ((<pk> BETWEEN <a> AND <b> OR <pk> IN (...)) AND <where>)
+        """
+        (ranges, singles) = self.key_ranges(keys=keys)
+        if not ranges:
+            return "`{pk}` IN ({ids})".format(
+                pk=primary_key, ids=', '.join([str(k) for k in singles]))
+        conditions = [
+            "`{pk}` BETWEEN {first} AND {last}".format(pk=primary_key,
+                                                       first=first,
+                                                       last=last)
+            for (first, last) in ranges
+        ]
+        if singles:
+            conditions.append("`{pk}` IN ({ids})".format(
+                pk=primary_key, ids=', '.join([str(k) for k in singles])))
+        logging.debug("%s keys coalesced into %s ranges and %s single keys",
+                      len(keys), len(ranges), len(singles))
+        return "(({conditions}) AND ({where}))".format(
+            conditions=' OR '.join(conditions), where=self.where)
+
+    def delete(self, database=None, table=None, limit=None, data=None,
+               check_children=True):
         """
         The delete method that has to be implemented (Source abstract class)
+        The rows which still have children are excluded before deleting if
+        check_blocking_children is enabled, the integrity errors left, as
+        for children in other databases, are handled by dichotomy
         """
+        if check_children and self.check_blocking_children and \
+                self.delete_data and self.foreign_key_check and \
+                '{db}.{table}'.format(db=database, table=table) \
+                not in self.tables_with_circular_fk:
+            blocked = self.blocked_rows(database=database,
+                                        table=table,
+                                        data=data)
+            if blocked:
+                data = Batch(columns=data.columns,
+                             rows=[
+                                 r for (i, r) in enumerate(data.rows)
+                                 if i not in blocked
+                             ])
+                if not data:
+                    return
         try:
             self.delete_set(database=database,
                             table=table,
@@ -398,21 +1138,23 @@ class Db(Source, DbBase):
             if len(data) == 1:
                 logging.error("OSArchiver hit a row that will never be deleted"
                               " unless you fix remaining chlidren data")
-                logging.error("Parent row that can not be deleted: %s", data)
+                row = data.as_dict(data[0])
+                logging.error("Parent row that can not be deleted: %s", row)
                 logging.error("To get children items:")
                 logging.error(
                     self.integrity_exception_select_statement(
-                        error=integrity_error.args[1], row=data[0]))
+                        error=integrity_error.args[1], row=row))
                 logging.error("Here a POTENTIAL fix, ensure BEFORE that data "
                               "should be effectively deleted, then run "
                               "osarchiver again:")
                 logging.error(
                     self.integrity_exception_potential_fix(
-                        error=integrity_error.args[1], row=data[0]))
+                        error=integrity_error.args[1], row=row))
             else:
                 logging.error("Integrity error caught, deleting with "
                               "dichotomy")
-                for subdata in array_split(data, 2):
+                half = (len(data) + 1) // 2
+                for subdata in (data[:half], data[half:]):
                     logging.debug(
                         "Dichotomy delete with a set of %s data "
                         "length", len(subdata))
@@ -423,7 +1165,8 @@ class Db(Source, DbBase):
                     self.delete(database=database,
                                 table=table,
                                 data=subdata,
-                                limit=len(subdata))
+                                limit=len(subdata),
+                                check_children=False)
 
     def clean_exit(self):
         """
@@ -0,0 +1,96 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the checks of the LOAD DATA of the db destination
+"""
+
+import unittest
+from unittest import mock
+
+from osarchiver.destination.db.db import Db
+from osarchiver.destination.db.errors import OSArchiverLoadDataFailed
+
+
+class CheckLoadDataTest(unittest.TestCase):
+    """
+    Db.check_load_data raises unless all the rows sent are stored
+    """
+
+    @staticmethod
+    def destination(duplicates='ignore', warnings=(), warning_count=None):
+        """
+        Return a Db destination whose connection returns warnings, out of
+        warning_count (all of them by default)
+        """
+        destination = Db.__new__(Db)
+        destination.load_data_duplicates = duplicates
+        destination.connection = mock.MagicMock()
+        destination.connection.show_warnings.return_value = warnings
+        warning_cursor = destination.connection.cursor.return_value.\
+            __enter__.return_value
+        warning_cursor.fetchone.return_value = (
+            len(warnings) if warning_count is None else warning_count, )
+        return destination
+
+    @staticmethod
+    def cursor(rowcount=0):
+        """
+        Return the cursor of a LOAD DATA which affected rowcount rows
+        """
+        return mock.Mock(rowcount=rowcount)
+
+    @staticmethod
+    def duplicates(count=0):
+        """
+        Return the warnings of count duplicate rows
+        """
+        return tuple([('Warning', 1062, "Duplicate entry '{}'".format(i))
+                      for i in range(count)])
+
+    def test_all_rows_loaded(self):
+        self.destination().check_load_data(cursor=self.cursor(rowcount=10),
+                                           rows=10)
+
+    def test_duplicates_ignored(self):
+        destination = self.destination(warnings=self.duplicates(count=1))
+        destination.check_load_data(
+            cursor=self.cursor(rowcount=9), rows=10)
+
+    def test_skipped_rows_not_duplicates(self):
+        destination = self.destination(warnings=self.duplicates(count=1))
+        with self.assertRaises(OSArchiverLoadDataFailed):
+            destination.check_load_data(
+                cursor=self.cursor(rowcount=8), rows=10)
+
+    def test_warnings_not_all_fetched(self):
+        # the server kept max_error_count warnings, a truncation may be
+        # among the dropped ones
+        destination = self.destination(warnings=self.duplicates(count=64),
+                                       warning_count=70)
+        with self.assertRaises(OSArchiverLoadDataFailed):
+            destination.check_load_data(cursor=self.cursor(rowcount=36),
+                                        rows=100)
+
+    def test_duplicates_replaced(self):
+        destination = self.destination(duplicates='replace')
+        destination.check_load_data(cursor=self.cursor(rowcount=12), rows=10)
+        with self.assertRaises(OSArchiverLoadDataFailed):
+            destination.check_load_data(cursor=self.cursor(rowcount=9),
+                                        rows=10)
+
+    def test_truncation_warning(self):
+        destination = self.destination(
+            warnings=(('Warning', 1265, "Data truncated for column 'name'"), ))
+        with self.assertRaises(OSArchiverLoadDataFailed):
+            destination.check_load_data(
+                cursor=self.cursor(rowcount=10), rows=10)
+
+    def test_too_many_rows(self):
+        with self.assertRaises(OSArchiverLoadDataFailed):
+            self.destination().check_load_data(
+                cursor=self.cursor(rowcount=11), rows=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
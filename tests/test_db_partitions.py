@@ -0,0 +1,189 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the archive tables of the db destination partitioned by month
+"""
+
+import datetime
+import unittest
+from unittest import mock
+
+from osarchiver.destination.db.db import Db
+from tests.test_schema import instances_schema
+
+
+def destination(future=3, retention=0):
+    """
+    Return a Db destination partitioning by month of deleted_at
+    """
+    db = Db.__new__(Db)
+    db.source = mock.Mock(deleted_column='deleted_at')
+    db.partition_future_months = future
+    db.partition_retention_months = retention
+    return db
+
+
+class PartitionedCreateTableStatementTest(unittest.TestCase):
+    """
+    Rewrite of the CREATE TABLE statement of the source table
+    """
+
+    def test_foreign_key_last_definition(self):
+        statement = "CREATE TABLE `instances` (\n"\
+            "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"\
+            "  `uuid` varchar(36) NOT NULL,\n"\
+            "  `deleted_at` datetime DEFAULT NULL,\n"\
+            "  `host_id` int(11) DEFAULT NULL,\n"\
+            "  PRIMARY KEY (`id`),\n"\
+            "  UNIQUE KEY `uniq_uuid` (`uuid`(10)),\n"\
+            "  KEY `host_id` (`host_id`),\n"\
+            "  CONSTRAINT `fk_host` FOREIGN KEY (`host_id`) REFERENCES "\
+            "`hosts` (`id`)\n"\
+            ") ENGINE=InnoDB AUTO_INCREMENT=5 DEFAULT CHARSET=utf8"
+        self.assertEqual(
+            destination().partitioned_create_table_statement(
+                statement=statement),
+            "CREATE TABLE `instances` (\n"
+            "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"
+            "  `uuid` varchar(36) NOT NULL,\n"
+            "  `deleted_at` datetime NOT NULL,\n"
+            "  `host_id` int(11) DEFAULT NULL,\n"
+            "  PRIMARY KEY (`id`,`deleted_at`),\n"
+            "  KEY `uniq_uuid` (`uuid`(10)),\n"
+            "  KEY `host_id` (`host_id`)\n"
+            ") ENGINE=InnoDB AUTO_INCREMENT=5 DEFAULT CHARSET=utf8")
+
+    def test_composite_primary_key_not_null_column(self):
+        statement = "CREATE TABLE `mappings` (\n"\
+            "  `a` int(11) NOT NULL,\n"\
+            "  `b` varchar(255) NOT NULL,\n"\
+            "  `deleted_at` datetime NOT NULL,\n"\
+            "  PRIMARY KEY (`a`,`b`(20)) USING BTREE\n"\
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8"
+        self.assertEqual(
+            destination().partitioned_create_table_statement(
+                statement=statement),
+            "CREATE TABLE `mappings` (\n"
+            "  `a` int(11) NOT NULL,\n"
+            "  `b` varchar(255) NOT NULL,\n"
+            "  `deleted_at` datetime NOT NULL,\n"
+            "  PRIMARY KEY (`a`,`b`(20),`deleted_at`) USING BTREE\n"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8")
+
+    def test_deleted_column_already_in_primary_key(self):
+        statement = "CREATE TABLE `t` (\n"\
+            "  `id` int(11) NOT NULL,\n"\
+            "  `deleted_at` datetime NOT NULL,\n"\
+            "  PRIMARY KEY (`id`,`deleted_at`)\n"\
+            ") ENGINE=InnoDB"
+        self.assertEqual(
+            destination().partitioned_create_table_statement(
+                statement=statement), statement)
+
+    def test_partitioned_definition(self):
+        schema = instances_schema()
+        schema.columns['instances'].append({
+            'name': 'deleted_at',
+            'data_type': 'datetime',
+            'column_type': 'datetime',
+            'nullable': True,
+            'default': None,
+            'collation': None,
+            'extra': '',
+            'comment': ''
+        })
+        definition = destination().partitioned_definition(
+            definition=schema.definition(table='instances'))
+        self.assertEqual(definition['indexes']['PRIMARY']['columns'],
+                         ['id', 'deleted_at'])
+        self.assertFalse(definition['columns'][2]['nullable'])
+        self.assertEqual(definition['foreign_keys'], [])
+        # the source definition is left untouched
+        self.assertEqual(schema.primary_keys(table='instances'), ['id'])
+
+
+class PartitionBoundsTest(unittest.TestCase):
+    """
+    Partitions to add and to drop
+    """
+
+    def test_to_days(self):
+        # SELECT TO_DAYS('2007-10-07') returns 733321
+        self.assertEqual(Db.to_days(day=datetime.date(2007, 10, 7)), 733321)
+        self.assertEqual(Db.from_days(days=733321), datetime.date(2007, 10, 7))
+
+    def test_add_months(self):
+        self.assertEqual(
+            Db.add_months(day=datetime.date(2026, 11, 17), months=2),
+            datetime.date(2027, 1, 1))
+        self.assertEqual(
+            Db.add_months(day=datetime.date(2026, 1, 31), months=-1),
+            datetime.date(2025, 12, 1))
+
+    def test_partition_definition(self):
+        self.assertEqual(
+            destination().partition_definition(
+                month=datetime.date(2026, 12, 1)),
+            "PARTITION p202612 VALUES LESS THAN ({})".format(
+                Db.to_days(day=datetime.date(2027, 1, 1))))
+
+    def test_future_partitions(self):
+        bounds = [('pold', datetime.date(2026, 9, 1)),
+                  ('p202609', datetime.date(2026, 10, 1)),
+                  ('p202610', datetime.date(2026, 11, 1)),
+                  ('pmax', None)]
+        (months, expired) = destination(future=2).partition_changes(
+            bounds=bounds, today=datetime.date(2026, 10, 17))
+        self.assertEqual(
+            months, [datetime.date(2026, 11, 1),
+                     datetime.date(2026, 12, 1)])
+        self.assertEqual(expired, [])
+
+    def test_up_to_date_partitions(self):
+        bounds = [('p202611', datetime.date(2026, 12, 1)), ('pmax', None)]
+        (months, _) = destination(future=1).partition_changes(
+            bounds=bounds, today=datetime.date(2026, 10, 31))
+        self.assertEqual(months, [])
+
+    def test_maxvalue_only(self):
+        (months, _) = destination(future=0).partition_changes(
+            bounds=[('pmax', None)], today=datetime.date(2026, 10, 17))
+        self.assertEqual(months, [datetime.date(2026, 10, 1)])
+
+    def test_expired_partitions(self):
+        bounds = [('pold', datetime.date(2026, 7, 1)),
+                  ('p202607', datetime.date(2026, 8, 1)),
+                  ('p202608', datetime.date(2026, 9, 1)),
+                  ('p202609', datetime.date(2026, 10, 1)),
+                  ('pmax', None)]
+        # rows of August and older are more than 2 months old in October
+        (_, expired) = destination(future=0, retention=2).partition_changes(
+            bounds=bounds, today=datetime.date(2026, 10, 17))
+        self.assertEqual(expired, ['pold', 'p202607'])
+
+    def test_maintain_partitions(self):
+        db = destination(future=1, retention=1)
+        db.get_archive_db_name = mock.Mock(return_value='nova_archive')
+        db.get_archive_table_name = mock.Mock(return_value='instances')
+        db.dry_run = False
+        today = datetime.date.today()
+        current = Db.add_months(day=today)
+        previous = Db.add_months(day=today, months=-1)
+        db.db_request = mock.Mock(side_effect=[
+            [('pold', str(Db.to_days(day=previous))),
+             ('p' + previous.strftime('%Y%m'),
+              str(Db.to_days(day=current))), ('pmax', 'MAXVALUE')], 1, 1
+        ])
+        db.maintain_partitions(database='nova', table='instances')
+        (reorganize, drop) = [c[1]['sql'] for c in
+                              db.db_request.call_args_list[1:]]
+        self.assertIn("REORGANIZE PARTITION `pmax` INTO (PARTITION p{}"
+                      .format(current.strftime('%Y%m')), reorganize)
+        self.assertIn("PARTITION `pmax` VALUES LESS THAN MAXVALUE",
+                      reorganize)
+        self.assertTrue(drop.endswith("DROP PARTITION `pold`"))
+
+
+if __name__ == '__main__':
+    unittest.main()
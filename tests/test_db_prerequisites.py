@@ -0,0 +1,136 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the prerequisites of the db destination kept in the metadata cache
+and of the schema fingerprints they depend on
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from osarchiver.common.cache import MetadataCache
+from osarchiver.common.schema import Schema
+from osarchiver.destination.db.db import Db
+from tests.test_schema import instances_schema
+
+
+class PrerequisitesCacheTest(unittest.TestCase):
+    """
+    The archive tables of the cached prerequisites are checked again when
+    they are not the expected ones
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = MetadataCache(
+            path=os.path.join(self.directory.name, 'cache.json'))
+        # tables of the archive database
+        self.archive_tables = {'instances': 10}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def destination(self, table_suffix=''):
+        """
+        Return a Db destination archiving the instances table of nova in
+        nova_archive, the archive tables created are added to archive_tables
+        """
+        db = Db.__new__(Db)
+        db.host = 'localhost'
+        db.port = 3306
+        db.table_suffix = table_suffix
+        db.partition_by_month = False
+        db.dry_run = False
+        db.metadata_cache = self.cache
+        db.checked_tables = set()
+        db.archive_db_name = 'nova_archive'
+        db.create_archive_db = mock.Mock()
+        db.source = mock.Mock()
+        db.source.tables_to_archive.return_value = ['instances']
+        db.source.get_schema_fingerprint.return_value = ('source', {})
+        db.source.get_schema.return_value = instances_schema()
+        db.get_schema_fingerprint = mock.Mock(
+            side_effect=lambda database, refresh=False:
+            ('archive', dict(self.archive_tables)))
+
+        def create_archive_table(database=None, table=None):
+            self.archive_tables[db.get_archive_table_name(table=table)] = 0
+
+        db.create_archive_table = mock.Mock(side_effect=create_archive_table)
+        return db
+
+    def check(self, db=None):
+        """
+        Check the prerequisites of nova, the archive schema has an instances
+        table identical to the source one
+        """
+        with mock.patch.object(Schema, 'load',
+                               return_value=instances_schema(
+                                   database='nova_archive')):
+            db.check_database_prerequisites(database='nova')
+
+    def test_cached_tables_not_checked_again(self):
+        self.check(db=self.destination())
+        db = self.destination()
+        self.check(db=db)
+        db.source.get_schema.assert_not_called()
+        self.assertEqual(db.checked_tables, {('nova', 'instances')})
+
+    def test_new_table_suffix(self):
+        self.check(db=self.destination(table_suffix='_2026'))
+        db = self.destination(table_suffix='_2027')
+        self.check(db=db)
+        db.create_archive_table.assert_called_once_with(database='nova',
+                                                        table='instances')
+
+    def test_archive_table_dropped(self):
+        self.check(db=self.destination(table_suffix='_old'))
+        self.archive_tables = {}
+        db = self.destination(table_suffix='_old')
+        self.check(db=db)
+        db.create_archive_table.assert_called_once_with(database='nova',
+                                                        table='instances')
+
+
+class SchemaFingerprintTest(unittest.TestCase):
+    """
+    The fingerprint of a schema is computed once per run
+    """
+
+    @staticmethod
+    def destination(checksum=False):
+        """
+        Return a Db destination whose archive database has one table
+        """
+        db = Db.__new__(Db)
+        db.fingerprints = {}
+        db.metadata_cache_checksum = checksum
+        db.db_request = mock.Mock(side_effect=lambda sql, fetch_method: [
+            ('instances', None, 10, 'InnoDB', 'utf8_general_ci', '', '')
+        ] if fetch_method == 'fetchall' else ('1:2', '3:4', '5:6', '7:8'))
+        return db
+
+    def test_fingerprint_computed_once(self):
+        db = self.destination()
+        (fingerprint, rows) = db.get_schema_fingerprint(database='nova')
+        self.assertEqual(rows, {'instances': 10})
+        self.assertEqual(db.get_schema_fingerprint(database='nova'),
+                         (fingerprint, rows))
+        self.assertEqual(db.db_request.call_count, 1)
+        db.get_schema_fingerprint(database='nova', refresh=True)
+        self.assertEqual(db.db_request.call_count, 2)
+
+    def test_checksum_option(self):
+        (fingerprint, _) = self.destination().get_schema_fingerprint(
+            database='nova')
+        db = self.destination(checksum=True)
+        self.assertNotEqual(
+            db.get_schema_fingerprint(database='nova')[0], fingerprint)
+        self.assertEqual(db.db_request.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
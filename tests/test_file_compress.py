@@ -0,0 +1,79 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the compression of the files of the file destination at exit
+"""
+
+import os
+import tarfile
+import tempfile
+import unittest
+
+from osarchiver.common.batch import Batch
+from osarchiver.destination.file.base import File
+
+
+class FileCompressTest(unittest.TestCase):
+    """
+    File.compress with one and several compression processes
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rows = [(i, 'name-{}'.format(i)) for i in range(5000)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_compress(self, **kwargs):
+        """
+        Write a csv file with a File destination and compress it, return the
+        archives and the content of the csv file
+        """
+        destination = File(directory=self.directory.name,
+                           formats='csv',
+                           **kwargs)
+        destination.write(database='db',
+                          table='table',
+                          data=Batch(columns=('id', 'name'), rows=self.rows))
+        destination.close()
+        with open(destination.files()[0], 'rb') as csv_file:
+            content = csv_file.read()
+        return (destination.compress(), content)
+
+    def assert_archive(self, archives=None, content=None):
+        """
+        Check that the archive contains the csv file only, with its content
+        """
+        self.assertEqual(len(archives), 1)
+        with tarfile.open(archives[0]) as archive:
+            self.assertEqual(archive.getnames(), ['db.table.csv'])
+            self.assertEqual(archive.extractfile('db.table.csv').read(),
+                             content)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory.name,
+                                        'db.table.csv')))
+
+    def test_compress_default_workers(self):
+        (archives, content) = self.write_and_compress(archive_format='gztar')
+        self.assert_archive(archives=archives, content=content)
+
+    def test_compress_parallel_chunks(self):
+        for archive_format in ['gztar', 'bztar', 'xztar']:
+            (archives, content) = self.write_and_compress(
+                archive_format=archive_format,
+                compress_workers=3,
+                compress_chunk_size=10000)
+            self.assertGreater(len(content), 3 * 10000)
+            self.assert_archive(archives=archives, content=content)
+            os.remove(archives[0])
+
+    def test_compress_parallel_files(self):
+        (archives, content) = self.write_and_compress(archive_format='tar',
+                                                      compress_workers=2)
+        self.assert_archive(archives=archives, content=content)
+
+
+if __name__ == '__main__':
+    unittest.main()
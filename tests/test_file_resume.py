@@ -0,0 +1,179 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the files of the file destination left by an interrupted run
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from osarchiver.common.batch import Batch
+from osarchiver.destination.file.base import File, SPOOL_EXTENSION
+from osarchiver.destination.file.parquet import pyarrow
+
+
+class FileResumeTest(unittest.TestCase):
+    """
+    A run writing in the directory of an interrupted one keeps its rows
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, rows=None, **kwargs):
+        """
+        Write rows in a csv file with a new File destination, return it
+        """
+        destination = File(directory=self.directory.name,
+                           formats='csv',
+                           **kwargs)
+        destination.write(database='db',
+                          table='table',
+                          data=Batch(columns=('id', ), rows=rows))
+        destination.close()
+        return destination
+
+    def test_plain_file_appended(self):
+        first = self.write(rows=[(1, ), (2, )])
+        second = self.write(rows=[(3, )])
+        self.assertEqual(first.files(), second.files())
+        with open(second.files()[0], 'r', encoding='utf-8') as csv_file:
+            self.assertEqual(csv_file.read().split(), ['id', '1', '2', '3'])
+
+    def test_compressed_file_not_overwritten(self):
+        first = self.write(rows=[(1, )], compression='gzip')
+        second = self.write(rows=[(2, )], compression='gzip')
+        self.assertEqual(first.files(),
+                         [os.path.join(self.directory.name,
+                                       'db.table.csv.gz')])
+        self.assertEqual(second.files(),
+                         [os.path.join(self.directory.name,
+                                       'db.table.1.csv.gz')])
+        with gzip.open(first.files()[0], 'rt') as csv_file:
+            self.assertEqual(csv_file.read().split(), ['id', '1'])
+
+    def test_flushed_sets_spooled(self):
+        destination = File(directory=self.directory.name,
+                           formats='csv',
+                           compression='gzip')
+        for row in [(1, ), (2, )]:
+            data = Batch(columns=('id', ), rows=[row])
+            destination.write(database='db', table='table', data=data)
+            destination.flush(database='db', table='table', data=data)
+        sizes = destination.file_sizes()
+        # the stream is not ended, the sets of data are durable in the spool
+        self.assertEqual(len(destination.files()), 1)
+        self.assertIsNone(sizes[destination.files()[0]])
+        (spool, ) = [f for f in sizes if f.endswith(SPOOL_EXTENSION)]
+        self.assertEqual(sizes[spool], os.path.getsize(spool))
+        destination.close()
+
+    def test_flushed_streams_readable(self):
+        for (compression, module) in [('gzip', gzip), ('bz2', bz2),
+                                      ('xz', lzma)]:
+            # the streams are ended after each set of data
+            destination = File(directory=self.directory.name,
+                               formats='csv',
+                               compression=compression,
+                               spool_size=1)
+            for row in [(1, ), (2, )]:
+                data = Batch(columns=('id', ), rows=[row])
+                destination.write(database=compression,
+                                  table='table',
+                                  data=data)
+                destination.flush(database=compression,
+                                  table='table',
+                                  data=data)
+            # the file is read as left by a crash, without being closed
+            path = destination.files()[0]
+            self.assertEqual(destination.file_sizes()[path],
+                             os.path.getsize(path))
+            with module.open(path, 'rt') as csv_file:
+                self.assertEqual(csv_file.read().split(), ['id', '1', '2'])
+            # the spools are removed once the sizes are checkpointed
+            destination.checkpointed(files=destination.file_sizes())
+            self.assertEqual(destination.spools, {})
+            destination.close()
+
+    def interrupted_run(self, compression=None, formats='csv', **kwargs):
+        """
+        Write two sets of data with a File destination as with a checkpoint,
+        the first one is durable in the files and the second one in the
+        spool only, and return the durable size of the files as saved in the
+        checkpoint when the run is interrupted
+        """
+        destination = File(directory=self.directory.name,
+                           formats=formats,
+                           compression=compression,
+                           **kwargs)
+        for row in [(1, ), (2, )]:
+            data = Batch(columns=('id', ), rows=[row])
+            destination.write(database='db', table='table', data=data)
+            destination.flush(database='db', table='table', data=data)
+            if row == (1, ):
+                with destination.lock:
+                    destination.rollover()
+        return destination.file_sizes()
+
+    def test_compressed_stream_adopted(self):
+        files = self.interrupted_run(compression='gzip')
+        path = os.path.join(self.directory.name, 'db.table.csv.gz')
+        # the interrupted run left a partial stream after the durable one
+        with open(path, 'ab') as compressed_file:
+            compressed_file.write(b'\x1f\x8b\x08\x00partial')
+        destination = File(directory=self.directory.name,
+                           formats='csv',
+                           compression='gzip')
+        destination.adopt_files(files=files)
+        destination.close()
+        self.assertEqual(os.path.getsize(path), files[path])
+        with gzip.open(path, 'rt') as csv_file:
+            self.assertEqual(csv_file.read().split(), ['id', '1'])
+        # the spooled set of data is written again in a new file
+        self.assertEqual(destination.files(), [
+            os.path.join(self.directory.name, 'db.table.1.csv.gz'), path
+        ])
+        with gzip.open(destination.files()[0], 'rt') as csv_file:
+            self.assertEqual(csv_file.read().split(), ['id', '2'])
+        destination.checkpointed(files=destination.file_sizes())
+        self.assertEqual([
+            f for f in os.listdir(self.directory.name)
+            if f.endswith(SPOOL_EXTENSION)
+        ], [])
+
+    @unittest.skipIf(pyarrow is None, "parquet format requires pyarrow")
+    def test_parquet_part_adopted(self):
+        source = mock.Mock()
+        source.get_schema.return_value.column.return_value = None
+        files = self.interrupted_run(formats='parquet', source=source)
+        parts = [f for f in files if f.endswith('.parquet')]
+        (closed, ) = [f for f in parts if files[f] is not None]
+        (open_part, ) = [f for f in parts if files[f] is None]
+        destination = File(directory=self.directory.name,
+                           formats='parquet',
+                           source=source)
+        destination.adopt_files(files=files)
+        destination.close()
+        rows = {
+            f: pyarrow.parquet.read_table(f).column('id').to_pylist()
+            for f in destination.files()
+        }
+        self.assertEqual(rows[closed], ['1'])
+        # the part which was not closed is removed, its set of data is
+        # written again from the spool in a new part
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([rows[f] for f in rows if f != closed], [['2']])
+        self.assertFalse(os.path.exists(open_part) and open_part not in rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the table definitions of the schema snapshots
+"""
+
+import copy
+import unittest
+
+from osarchiver.common.schema import Schema
+
+
+def instances_schema(database='nova'):
+    """
+    Return the snapshot of a database with an instances table referencing a
+    hosts table
+    """
+    return Schema(
+        database=database,
+        tables={'instances': 10},
+        columns={
+            'instances': [{
+                'name': 'id',
+                'data_type': 'int',
+                'column_type': 'int(11)',
+                'nullable': False,
+                'default': None,
+                'collation': None,
+                'extra': 'auto_increment',
+                'comment': ''
+            }, {
+                'name': 'host_id',
+                'data_type': 'int',
+                'column_type': 'int(11)',
+                'nullable': True,
+                'default': None,
+                'collation': None,
+                'extra': '',
+                'comment': ''
+            }]
+        },
+        indexes={
+            'instances': {
+                'PRIMARY': {
+                    'columns': ['id'],
+                    'sub_parts': [None],
+                    'unique': True,
+                    'type': 'BTREE'
+                }
+            }
+        },
+        foreign_keys=[{
+            'name': 'fk_host',
+            'table': 'instances',
+            'columns': ['host_id'],
+            'referenced_schema': database,
+            'referenced_table': 'hosts',
+            'referenced_columns': ['id'],
+            'update_rule': 'RESTRICT',
+            'delete_rule': 'RESTRICT'
+        }],
+        options={
+            'instances': {
+                'engine': 'InnoDB',
+                'collation': 'utf8_general_ci',
+                'create_options': '',
+                'comment': ''
+            }
+        })
+
+
+class DefinitionHashTest(unittest.TestCase):
+    """
+    Schema.definition_hash changes with what SHOW CREATE TABLE shows
+    """
+
+    def setUp(self):
+        self.source = instances_schema()
+        self.reference = self.source.definition_hash(table='instances')
+
+    def test_same_definition_in_another_database(self):
+        archive = instances_schema(database='nova_archive')
+        archive.options['instances']['create_options'] = 'partitioned'
+        self.assertEqual(archive.definition_hash(table='instances'),
+                         self.reference)
+
+    def test_changes(self):
+        changes = [
+            lambda s: s.columns['instances'][1].update(nullable=False),
+            lambda s: s.columns['instances'][1].update(default='0'),
+            lambda s: s.columns['instances'][1].update(collation='utf8_bin'),
+            lambda s: s.foreign_keys[0].update(delete_rule='CASCADE'),
+            lambda s: s.foreign_keys.pop(),
+            lambda s: s.options['instances'].update(engine='MyISAM'),
+            lambda s: s.indexes['instances']['PRIMARY'].update(
+                sub_parts=[10])
+        ]
+        for change in changes:
+            schema = copy.deepcopy(self.source)
+            change(schema)
+            self.assertNotEqual(schema.definition_hash(table='instances'),
+                                self.reference)
+
+
+if __name__ == '__main__':
+    unittest.main()
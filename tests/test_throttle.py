@@ -0,0 +1,67 @@
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+# Copyright 2019 The OSArchiver Authors. All rights reserved.
+"""
+Tests of the sampling of the server load by the Throttle
+"""
+
+import unittest
+from unittest import mock
+
+import pymysql
+
+from osarchiver.common.throttle import Throttle
+
+
+class ThrottleSampleTest(unittest.TestCase):
+    """
+    Throttle.load keeps the metrics whose sampling fails transiently
+    """
+
+    @staticmethod
+    def connection(results=None):
+        """
+        Return a connection whose cursors return the rows or raise the
+        exceptions of results, one per query
+        """
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = cursor
+        cursor.execute.side_effect = [
+            r if isinstance(r, Exception) else None for r in results
+        ]
+        cursor.fetchall.side_effect = [
+            r for r in results if not isinstance(r, Exception)
+        ]
+        connection = mock.Mock()
+        connection.cursor.return_value = cursor
+        return connection
+
+    def test_transient_error_keeps_last_load(self):
+        throttle = Throttle(sample_interval=0)
+        self.assertEqual(
+            throttle.load(connection=self.connection(results=[
+                [{'Value': '100'}], [{'count': 0}], [], []
+            ])), 2)
+        lost = pymysql.OperationalError(2013, 'Lost connection')
+        self.assertEqual(
+            throttle.load(connection=self.connection(
+                results=[lost, lost, lost, lost])), 2)
+        self.assertEqual(throttle.unavailable, set())
+        self.assertEqual(
+            throttle.load(connection=self.connection(results=[
+                [{'Value': '5'}], [{'count': 0}], [], []
+            ])), 0.1)
+
+    def test_unsupported_metric_disabled(self):
+        throttle = Throttle(sample_interval=0)
+        throttle.load(connection=self.connection(results=[
+            [{'Value': '5'}],
+            pymysql.OperationalError(1142, 'SELECT command denied'),
+            pymysql.ProgrammingError(1146, "Table doesn't exist"), []
+        ]))
+        self.assertEqual(throttle.unavailable,
+                         {'history_length', 'replication_lag'})
+
+
+if __name__ == '__main__':
+    unittest.main()